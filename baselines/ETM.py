@@ -1,4 +1,3 @@
-import sqlite3
 import re
 from copy import deepcopy as dc
 import os, sys, json
@@ -7,7 +6,9 @@ from tqdm import tqdm
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 sys.path.insert(0, os.path.join(BASE_DIR, 'ETM.zip'))
 from treeMatch import preprocess, parseTree, compareTrees
-from ETM_utils.process_sql import get_schema
+sys.path.insert(0, os.path.abspath(os.path.join(BASE_DIR, '..')))
+from evaluators.connections import db_connection
+from evaluators.schema import get_catalog
 
 def ETM(question, pred_sql) -> bool:
     ALLRULES = [100,101,102,103,104,105,106,107,108,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17,18,19,20,21,22,23,24,25,26]
@@ -15,16 +16,16 @@ def ETM(question, pred_sql) -> bool:
     db_id = question["db_id"]
     project_root = os.path.abspath(os.path.join(BASE_DIR, '..'))
     db = os.path.join(project_root, 'dev_databases', db_id, f'{db_id}.sqlite')
-    schema = get_schema(db)
+    schema = get_catalog(db_id, project_root).etm_schema()
     gold = preprocess(question["gold_sql"], schema)
     pred = preprocess(pred_sql, schema)
 
-    conn = sqlite3.connect(db)
-    c = conn.cursor()
     bad = False
     try:
-        c.execute("EXPLAIN QUERY PLAN " + gold)
-        c.execute("EXPLAIN QUERY PLAN " + pred)
+        with db_connection(db) as conn:
+            c = conn.cursor()
+            c.execute("EXPLAIN QUERY PLAN " + gold)
+            c.execute("EXPLAIN QUERY PLAN " + pred)
     except Exception:
         bad = True
 
@@ -3,7 +3,7 @@ import sys
 import json
 import argparse
 import re
-import sqlite3
+from pathlib import Path
 from tqdm import tqdm
 
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
@@ -11,49 +11,34 @@ PROJECT_ROOT = os.path.abspath(os.path.join(BASE_DIR, '..'))
 if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
-from evaluators.utils import run_with_timeout, save_json
+from evaluators.utils import run_with_timeout, run_together, save_json, summarize_sql, compare_result
+from evaluators.executor import configure_sql_backend, SQL_BACKENDS
+from evaluators.cache import GoldResultCache
 
 
 def _resolve_db_path(db_id: str) -> str:
     return os.path.join(PROJECT_ROOT, 'dev_databases', db_id, f'{db_id}.sqlite')
 
 
-def _sqlite_fetchall(db_id: str, sql: str):
-    db_path = _resolve_db_path(db_id)
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
-        cur.execute(sql)
-        rows = cur.fetchall()
-    return rows
-
-
-def _rows_equal(pred_rows, gold_rows) -> bool:
-    if pred_rows is None and gold_rows is None:
-        return True
-    if pred_rows is None or gold_rows is None:
-        return False
-    try:
-        return set(pred_rows) == set(gold_rows)
-    except Exception:
-        try:
-            pred_rows = [tuple(r) for r in (pred_rows or [])]
-            gold_rows = [tuple(r) for r in (gold_rows or [])]
-            return set(pred_rows) == set(gold_rows)
-        except Exception:
-            return False
-
-
-def EX(question: dict, pred_sql: str) -> bool:
-    db_id = question["db_id"]
+def EX(question: dict, pred_sql: str, gold_cache: GoldResultCache = None) -> bool:
+    db_path = Path(_resolve_db_path(question["db_id"]))
     gold_sql = question["gold_sql"]
 
-    gold_rows = run_with_timeout(_sqlite_fetchall, db_id, gold_sql, timeout=45)
-    pred_rows = run_with_timeout(_sqlite_fetchall, db_id, pred_sql, timeout=45)
-
-    if gold_rows is False or pred_rows is False:
+    gold = gold_cache.get(db_path, gold_sql, "set") if gold_cache is not None else None
+    if gold is not None:
+        pred = run_with_timeout(summarize_sql, db_path, pred_sql, "set", timeout=45)
+    else:
+        # Either side failing decides EX, so each cancels the other.
+        pred, gold = run_together([(summarize_sql, db_path, pred_sql, "set"), (summarize_sql, db_path, gold_sql, "set")], timeout=45, decisive=(0, 1),
+                                  uncached=(1,) if gold_cache is not None else ())
+        if gold_cache is not None and gold is not None:
+            gold_cache.put(db_path, gold_sql, gold, "set")
+
+    if gold is False or pred is False:
         return False
-
-    return _rows_equal(pred_rows, gold_rows)
+    if gold is None or pred is None:
+        return gold is None and pred is None
+    return compare_result(pred, gold, semantics="set")
 
 
 def main():
@@ -62,6 +47,11 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--input', dest='input_path', default=None)
     parser.add_argument('--skip-file', type=str, default=None)
+    parser.add_argument('--sql-backend', choices=SQL_BACKENDS, default='spawn', help='How SQL is executed under its timeout')
+    parser.add_argument('--sql-workers', type=int, default=0, help='Worker processes for --sql-backend pool')
+    parser.add_argument('--sql-max-ops', type=int, default=None, help='SQLite VM operation budget per query (pool/inprocess)')
+    parser.add_argument('--cache-dir', type=str, default=os.path.join(base, 'cache'), help='Directory for persistent SQL result caches')
+    parser.add_argument('--no-gold-cache', action='store_true', help='Always re-execute gold SQL')
     args = parser.parse_args()
 
     input_path = args.input_path if args.input_path else os.path.join(base, 'test.json')
@@ -72,6 +62,9 @@ def main():
     with open(input_path, 'r', encoding='utf-8') as f:
         questions = json.load(f)
 
+    configure_sql_backend(args.sql_backend, workers=args.sql_workers or None, max_ops=args.sql_max_ops)
+    gold_cache = None if args.no_gold_cache else GoldResultCache(os.path.join(args.cache_dir, 'gold'))
+
     skip_ids = set()
     if args.skip_file and os.path.exists(args.skip_file):
         try:
@@ -104,7 +97,7 @@ def main():
     to_process = [q for q in questions if str(q.get('question_id')) not in processed_ids]
     for q in tqdm(to_process, total=len(to_process)):
         pred_sql = q.get('predicted_sql') or ''
-        score = 1.0 if EX(q, pred_sql) else 0.0
+        score = 1.0 if EX(q, pred_sql, gold_cache) else 0.0
         out_row = {
             "question_id": q.get("question_id"),
             "question": q.get("question"),
@@ -2,6 +2,7 @@ import os
 import sys
 import json
 import argparse
+import asyncio
 import re
 from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
@@ -12,13 +13,15 @@ if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 
 from evaluators.utils import execute_sql, write_result_to_file, run_with_timeout
+from evaluators.executor import configure_sql_backend
 from evaluators.Prover import Prover
+from evaluators.cli import add_run_arguments, RunSetup, run_bounded, run_steps, arun_steps, run_sql
 
 
-def _process_question(question, prover, output_dir):
+def _question_steps(question, output_dir):
     pred_sql = question["predicted_sql"]
     db_id = question["db_id"]
-    pred_res = run_with_timeout(execute_sql, db_id, pred_sql, timeout=60)
+    pred_res = yield "sql", (execute_sql, db_id, pred_sql)
     score = 0.0
     prover_verdict = None
 
@@ -26,19 +29,44 @@ def _process_question(question, prover, output_dir):
         return 
     if pred_res is False:
         score = 0.0
-        write_result_to_file(question, pred_sql, score, prover_verdict, None, output_dir)
+        yield "write", (question, pred_sql, score, prover_verdict, None, output_dir)
         return 
-    prover_verdict, _ = prover.call(question, pred_sql, pred_res)
+    prover_verdict, _ = yield "prover", (question, pred_sql, pred_res)
     if prover_verdict is None:
         return 
     score = 1.0 if prover_verdict else 0.0
-    write_result_to_file(question, pred_sql, score, prover_verdict, None, output_dir)
+    yield "write", (question, pred_sql, score, prover_verdict, None, output_dir)
     return 
 
+def _process_question(question, prover, output_dir):
+    def run_step(stage, *args):
+        if stage == "sql":
+            return run_with_timeout(*args, timeout=60)
+        return (prover.call if stage == "prover" else write_result_to_file)(*args)
+
+    run_steps(_question_steps(question, output_dir), run_step)
+
+async def _aprocess_question(question, prover, output_dir):
+    async def run_step(stage, *args):
+        if stage == "sql":
+            return await run_sql(run_with_timeout, *args, timeout=60)
+        if stage == "prover":
+            return await prover.acall(*args)
+        return await asyncio.to_thread(write_result_to_file, *args)
+
+    await arun_steps(_question_steps(question, output_dir), run_step)
+
+async def _run_async(questions, prover, output_dir, max_inflight, sql_threads, progress):
+    async def run(q, inflight):
+        async with inflight:
+            await _aprocess_question(q, prover, output_dir)
+        progress.update(1)
+
+    await run_bounded(questions, run, max_inflight, sql_threads)
+
 def main():
     parser = argparse.ArgumentParser(description="Prover Only ablation experiment")
-    parser.add_argument("--threads", type=int, default=1, help="Number of threads")
-    parser.add_argument("--input", type=str, default="sample.json", help="Input file path")
+    add_run_arguments(parser)
     args = parser.parse_args()
     reasoning_model = "gemini-2.5-pro-thinking"
 
@@ -46,7 +74,9 @@ def main():
     output_dir = f"output/{input_stem}/{reasoning_model}-ProverOnly-{input_stem}-eval"
     os.makedirs(output_dir, exist_ok=True)
 
-    prover = Prover(model=reasoning_model, output_dir=output_dir)
+    run_setup = RunSetup(args, output_dir)
+    prover = Prover(model=reasoning_model, output_dir=output_dir, **run_setup.verifier_options)
+    configure_sql_backend(args.sql_backend, workers=args.sql_workers or 2 * max(1, args.threads), max_ops=args.sql_max_ops)
 
     num_threads = max(1, int(args.threads))
     existing_results_path = os.path.join(output_dir, "eval_results.json")
@@ -80,12 +110,16 @@ def main():
             progress.update(1)
         return []
 
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        futures = [executor.submit(worker, i) for i in range(num_threads)]
-        for f in futures:
-            f.result()
+    if args.async_mode:
+        asyncio.run(_run_async(questions, prover, output_dir, max(1, args.max_inflight), num_threads, progress))
+    else:
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            futures = [executor.submit(worker, i) for i in range(num_threads)]
+            for f in futures:
+                f.result()
 
     progress.close()
+    run_setup.report()
 
 
 if __name__ == "__main__":
@@ -1,18 +1,20 @@
 #!/usr/bin/env python3
 
-import os
 import re
 import json
-import sqlite3
 from pathlib import Path
 from typing import Optional
 
-import openai
 from tqdm import tqdm
 from dotenv import load_dotenv
 
 import sys
 BASE_DIR = Path(__file__).resolve().parents[1]
+if str(BASE_DIR) not in sys.path:
+    sys.path.insert(0, str(BASE_DIR))
+from evaluators.connections import db_connection
+from evaluators.llm import get_client
+from evaluators.schema import get_catalog
 
 load_dotenv()
 
@@ -20,7 +22,7 @@ MODEL = "gpt-5"
 
 def _is_sql_executable(db_file: Path, sql: str) -> bool:
     try:
-        with sqlite3.connect(db_file) as conn:
+        with db_connection(db_file) as conn:
             conn.execute(sql)
         return True
     except Exception:
@@ -30,24 +32,8 @@ def _build_full_schema_context(db_id: str) -> str:
     db = BASE_DIR / "dev_databases" / db_id / f"{db_id}.sqlite"
     if not db.exists():
         return "Schema:\n"
-    with sqlite3.connect(db) as conn:
-        cur = conn.cursor()
-        tables = [r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name;")]
-        schema_lines = []
-        for t in tables:
-            cols = cur.execute(f"PRAGMA table_info('{t}')").fetchall()
-            fks = cur.execute(f"PRAGMA foreign_key_list('{t}')").fetchall()
-            fk_dict = {fk[3]: f"{fk[2]}.{fk[4]}" for fk in fks}
-            col_defs = []
-            for c in cols:
-                d = f"{c[1]} {c[2]}"
-                if c[5]:
-                    d += " PRIMARY KEY"
-                if c[1] in fk_dict:
-                    d += f" foreign key({fk_dict[c[1]]})"
-                col_defs.append(d)
-            schema_lines.append(f"{t} ({', '.join(col_defs)})\n")
-    return "Schema:\n" + "\n".join(schema_lines)
+    catalog = get_catalog(db_id, BASE_DIR)
+    return "Schema:\n" + "\n".join(catalog.schema_lines(catalog.tables))
 
 
 def _extract_first_sql(text: str) -> Optional[str]:
@@ -126,7 +112,7 @@ Return EXACTLY ONE executable SQL statement and nothing else (no code fences, co
 {schema}
     """
 
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
+    client = get_client(MODEL)
 
     last_sql: Optional[str] = None
     for attempt in range(1, max_attempts + 1):
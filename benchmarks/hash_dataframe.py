@@ -0,0 +1,67 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from pandas.util import hash_pandas_object
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from evaluators.results import hash_dataframe
+
+
+def legacy_hash_dataframe(df: pd.DataFrame) -> int:
+    """The original per-cell str() implementation, kept here as the baseline"""
+    df_str = df.map(str)
+    row_hash = None
+    for col in df_str.columns:
+        h_col = hash_pandas_object(df_str[col], index=False).to_numpy()
+        row_hash = h_col if row_hash is None else np.bitwise_xor(row_hash, h_col)
+    return int(np.bitwise_xor.reduce(row_hash))
+
+
+def make_frame(rows: int, cols: int, seed: int = 0) -> pd.DataFrame:
+    """Mix of the column kinds BIRD results contain: ints, floats with NULLs, text"""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        kind = i % 3
+        if kind == 0:
+            data[f"c{i}"] = rng.integers(0, 1_000_000, rows)
+        elif kind == 1:
+            v = rng.random(rows) * 1000
+            v[rng.random(rows) < 0.05] = np.nan
+            data[f"c{i}"] = v
+        else:
+            data[f"c{i}"] = pd.Series(rng.integers(0, 50_000, rows)).map(lambda x: f"name_{x}").astype(object)
+    return pd.DataFrame(data)
+
+
+def bench(func, df: pd.DataFrame, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark hash_dataframe against the legacy str() implementation")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    shapes = [("tall", 1_000_000, 3), ("wide", 10_000, 300), ("small", 200, 5)]
+    print(f"{'shape':<8}{'rows x cols':>16}{'legacy (s)':>14}{'typed (s)':>12}{'speedup':>10}")
+    for name, rows, cols in shapes:
+        df = make_frame(rows, cols)
+        legacy = bench(legacy_hash_dataframe, df, args.repeat)
+        typed = bench(hash_dataframe, df, args.repeat)
+        print(f"{name:<8}{f'{rows} x {cols}':>16}{legacy:>14.4f}{typed:>12.4f}{legacy / typed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,15 @@ import pandas as pd
 import sqlite3, os, time, re, io, json, sys, argparse
 from typing import Tuple, Optional, Dict, Any, List
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 import sqlparse
 
+_root = Path(__file__).resolve().parents[2]
+if str(_root) not in sys.path:
+    sys.path.insert(0, str(_root))
+from evaluators.cache import GoldResultCache
+from evaluators.schema import get_catalog
+
 st.set_page_config(page_title="NL2SQL Annotator", layout="wide")
 
 # --------------------------- Utilities ---------------------------
@@ -82,20 +89,21 @@ def run_sql(db_path: str, sql: str, limit_rows: int = 200) -> Tuple[Optional[pd.
         dt = time.time() - t0
         return None, f"{type(e).__name__}: {e}", dt
 
-def get_schema_ddl(db_path: str) -> str:
+_gold_cache = GoldResultCache(_root / "cache" / "gold")
+
+def run_gold_sql(db_path: str, sql: str, limit_rows: int = 200) -> Tuple[Optional[pd.DataFrame], Optional[str], float]:
+    # Reuse the evaluation runs' gold cache when its preview already holds the whole result.
     try:
-        with connect_ro(db_path) as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT type, name, sql FROM sqlite_master WHERE type IN ('table','view','index','trigger') AND name NOT LIKE 'sqlite_%' ORDER BY type, name;")
-            rows = cur.fetchall()
-            if not rows:
-                return "-- No user tables/views found"
-            ddls = []
-            for t, n, s in rows:
-                if not s:
-                    continue
-                ddls.append(s.strip().rstrip(";") + ";")
-            return "\n\n".join(ddls)
+        cached = _gold_cache.get(Path(db_path), sql)
+    except Exception:
+        cached = None
+    if cached and cached.complete and cached.row_count <= limit_rows:
+        return cached.preview, None, 0.0
+    return run_sql(db_path, sql, limit_rows)
+
+def get_schema_ddl(db_id: str) -> str:
+    try:
+        return get_catalog(db_id, _root).ddl_text()
     except Exception as e:
         return f"-- schema error: {e}"
 
@@ -291,15 +299,13 @@ if st.session_state["prev_idx"] != st.session_state["idx"]:
 
 st.markdown(f"<div style='font-size:1.1rem; color:#666'>DB: `{item['db_id']}`</div>", unsafe_allow_html=True)
 
-_root = Path(__file__).resolve().parents[2]
 _db_path = str(_root / "dev_databases" / item["db_id"] / f"{item['db_id']}.sqlite")
 if os.path.exists(_db_path):
     def _get_db_description(db_id: str) -> str:
-        desc_path = _root / "data" / "description" / f"{db_id}_schema.json"
-        if not desc_path.exists():
-            return "-- No description found"
         try:
-            data = json.loads(desc_path.read_text(encoding="utf-8"))
+            data = get_catalog(db_id, _root).descriptions
+            if data is None:
+                return "-- No description found"
             parts = []
             for table, cols in data.items():
                 parts.append(f"-- Table: {table}")
@@ -319,7 +325,7 @@ if os.path.exists(_db_path):
         except Exception as e:
             return f"-- description error: {e}"
     with st.expander("📚 Schema", expanded=False):
-        ddl = get_schema_ddl(_db_path)
+        ddl = get_schema_ddl(item["db_id"])
         st.code(ddl, language="sql")
     
     with st.expander("📖 Description", expanded=False):
@@ -370,10 +376,14 @@ pred_err = gold_err = None
 pred_time = gold_time = 0.0
 
 if os.path.exists(_db_path):
-    if item["predicted_sql"]:
-        pred_df, pred_err, pred_time = run_sql(_db_path, item["predicted_sql"])
-    if item["gold_sql"]:
-        gold_df, gold_err, gold_time = run_sql(_db_path, item["gold_sql"])
+    # Both results are shown side by side, so neither run cancels the other; they only overlap.
+    with ThreadPoolExecutor(max_workers=2) as _sql_executor:
+        pred_future = _sql_executor.submit(run_sql, _db_path, item["predicted_sql"]) if item["predicted_sql"] else None
+        gold_future = _sql_executor.submit(run_gold_sql, _db_path, item["gold_sql"]) if item["gold_sql"] else None
+        if pred_future is not None:
+            pred_df, pred_err, pred_time = pred_future.result()
+        if gold_future is not None:
+            gold_df, gold_err, gold_time = gold_future.result()
 
 with res_cols[0]:
     st.markdown("**Predicted result**")
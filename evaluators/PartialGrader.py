@@ -1,31 +1,37 @@
+import asyncio
 import sqlparse
 from typing import Dict, Any
+from .llm import get_client
 from .utils import get_db_info
 from .partial_scoring import Decomposer, Translator, Grader
 
 class PartialScoringPipeline:
     def __init__(self, model: str = "deepseek-chat"):
         self.model = model
+        self.client = get_client(model)
         self.results = []
     
+    def _question_obj(self, question: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "question_id": question["question_id"],
+            "db_id": question["db_id"],
+            "question": question["question"],
+            "evidence": question.get("evidence", ""),
+            "gold_sql": sqlparse.format(question["gold_sql"], reindent=True, keyword_case='upper'),
+            "schema": get_db_info(question["db_id"], question["gold_sql"])
+        }
+
     def eval(self, question: Dict[str, Any], pred_sql: str) -> float:
         try:
-            question_obj = {
-                "question_id": question["question_id"],
-                "db_id": question["db_id"],
-                "question": question["question"],
-                "evidence": question.get("evidence", ""),
-                "gold_sql": sqlparse.format(question["gold_sql"], reindent=True, keyword_case='upper'),
-                "schema": get_db_info(question["db_id"], question["gold_sql"])
-            }
+            question_obj = self._question_obj(question)
             
-            constraint_extractor = Decomposer(question_obj, model=self.model)
+            constraint_extractor = Decomposer(question_obj, model=self.model, client=self.client)
             constraints = constraint_extractor.call()
             
-            rubric_designer = Translator(question_obj, constraints, model=self.model)
+            rubric_designer = Translator(question_obj, constraints, model=self.model, client=self.client)
             designed_rubric = rubric_designer.call()
             
-            rubric_grader = Grader(question_obj, designed_rubric, model=self.model)
+            rubric_grader = Grader(question_obj, designed_rubric, model=self.model, client=self.client)
             grading_results = rubric_grader.call(pred_sql)
             
             usefulness_score = self._calculate_usefulness_score(grading_results, designed_rubric)
@@ -34,6 +40,19 @@ class PartialScoringPipeline:
         except Exception as e:
             print("Error in partial scoring pipeline", e)
 
+    async def aeval(self, question: Dict[str, Any], pred_sql: str) -> float:
+        try:
+            question_obj = await asyncio.to_thread(self._question_obj, question)
+
+            constraints = await Decomposer(question_obj, model=self.model, client=self.client).acall()
+            designed_rubric = await Translator(question_obj, constraints, model=self.model, client=self.client).acall()
+            grading_results = await Grader(question_obj, designed_rubric, model=self.model, client=self.client).acall(pred_sql)
+
+            return self._calculate_usefulness_score(grading_results, designed_rubric)
+
+        except Exception as e:
+            print("Error in partial scoring pipeline", e)
+
     def _calculate_usefulness_score(self, grading_results, rubric_questions):
         total_score = sum(float(r["score"]) for r in grading_results)
         total_weight = sum(float(q["weight"]) for q in rubric_questions)
@@ -1,57 +1,70 @@
-import os
 import json
-import openai
+import asyncio
 from dotenv import load_dotenv
-from typing import Dict, Any
-from .utils import get_db_info, extract_json_from_response, save_json
+from typing import Dict, Any, List
+from .llm import get_async_client, chat, achat
+from .failures import record_failure
+from .prompting import prefix_cached_messages
+from .utils import extract_json_from_response, has_verdict
+from .verifier import Verifier
 from prompts.prompt_prover import system_prompt_prover, user_prompt_prover
 
 load_dotenv()
 
 
-class Prover:
+class Prover(Verifier):
     """Prover validates whether predicted SQL queries adequately answer given questions"""
     
-    def __init__(self, model: str = None, output_dir: str = "output"):
-        self.model = model
-        self.output_dir = output_dir
-    
-    def call(self, question: Dict[str, Any], pred_sql: str, pred_result: Any) -> tuple[bool, str]:
-        """Validate whether predicted SQL adequately answers the question"""
-        try:
-            db_info = get_db_info(question["db_id"], pred_sql)
-            pred_result = pred_result.head(20)
-            
-            user_content = user_prompt_prover.format(
+    def _messages(self, question: Dict[str, Any], pred_sql: str, pred_result: Any) -> List[Dict[str, str]]:
+        pred_result = pred_result.head(20)
+        if self.prefix_cache:
+            return prefix_cached_messages(
+                system_prompt_prover, question["db_id"], user_prompt_prover,
                 question=question["question"],
                 evidence=question.get("evidence", ""),
                 predicted_sql=pred_sql,
-                db_info=db_info,
                 sql_result=pred_result
             )
-            
-            client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt_prover},
-                    {"role": "user", "content": user_content}
-                ],
-                # temperature=0
-            )
+        db_info = self._db_info(question, pred_sql)
+        
+        user_content = user_prompt_prover.format(
+            question=question["question"],
+            evidence=question.get("evidence", ""),
+            predicted_sql=pred_sql,
+            db_info=db_info,
+            sql_result=pred_result
+        )
+        return [
+            {"role": "system", "content": system_prompt_prover},
+            {"role": "user", "content": user_content}
+        ]
+
+    def _finish(self, question: Dict[str, Any], content: str) -> tuple[bool, str]:
+        result = json.loads(extract_json_from_response(content))
+        self._save(question, result, "prover_output.json")
+        return result.get("verdict", None), result.get("reason", "")
+
+    def call(self, question: Dict[str, Any], pred_sql: str, pred_result: Any) -> tuple[bool, str]:
+        """Validate whether predicted SQL adequately answers the question"""
+        try:
+            messages = self._messages(question, pred_sql, pred_result)
+            # temperature=0
+            content = chat(self.client, self.model, messages, stream=self.stream, stage="prover", validate=has_verdict)
+            return self._finish(question, content)
 
-            result = json.loads(extract_json_from_response(response.choices[0].message.content))
-            # print(response.choices[0].message.content)
-            # Save output to a single JSON file (append mode)
-            output_data = {
-                "question_id": question["question_id"],
-                "result": result
-            }
-            output_file = os.path.join(self.output_dir, "prover_output.json")
-            save_json(output_data, output_file, append=True)
+        except Exception as e:
+            record_failure("prover", e)
+            print(f"Prover error: {e}")
+            return None, f"Error: {e}"
 
-            return result.get("verdict", None), result.get("reason", "")
+    async def acall(self, question: Dict[str, Any], pred_sql: str, pred_result: Any) -> tuple[bool, str]:
+        """Async call: schema lookup and output writes run in a thread, the request on the event loop"""
+        try:
+            messages = await asyncio.to_thread(self._messages, question, pred_sql, pred_result)
+            content = await achat(self.async_client or get_async_client(self.model), self.model, messages, stream=self.stream, stage="prover", validate=has_verdict)
+            return await asyncio.to_thread(self._finish, question, content)
 
         except Exception as e:
+            record_failure("prover", e)
             print(f"Prover error: {e}")
             return None, f"Error: {e}"
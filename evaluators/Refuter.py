@@ -1,72 +1,67 @@
-import os
 import json
-import openai
+import asyncio
 from dotenv import load_dotenv
-from typing import Dict, Any
-from .utils import get_db_info, extract_json_from_response, save_json
+from typing import Dict, Any, List
+from .llm import get_async_client, chat, achat
+from .failures import record_failure
+from .prompting import prefix_cached_messages
+from .utils import extract_json_from_response, has_verdict
+from .verifier import Verifier
 from prompts.prompt_refuter import system_prompt_refuter, user_prompt_refuter, user_prompt_refuter_without_results
 
 load_dotenv()
 
 
-class Refuter:
+class Refuter(Verifier):
     """Refuter validates predicted SQL against gold standard SQL to identify critical conflicts"""
     
-    def __init__(self, model: str = None, output_dir: str = "output"):
-        self.model = model
-        self.output_dir = output_dir
-    
+    def _messages(self, question: Dict[str, Any], pred_sql: str, pred_result: Any = None, gold_result: Any = None, prover_reason: str = None) -> List[Dict[str, str]]:
+        if pred_result is not None and gold_result is not None:
+            template = user_prompt_refuter
+            fields = dict(pred_result=pred_result.head(20), gold_result=gold_result.head(20), prover_reason=prover_reason)
+        else:
+            template = user_prompt_refuter_without_results
+            fields = {}
+        fields.update(
+            question=question["question"],
+            evidence=question.get("evidence", ""),
+            predicted_sql=pred_sql,
+            gold_sql=question["gold_sql"],
+        )
+        if self.prefix_cache:
+            return prefix_cached_messages(system_prompt_refuter, question["db_id"], template, **fields)
+        db_info = self._db_info(question, [pred_sql, question["gold_sql"]])
+        return [
+            {"role": "system", "content": system_prompt_refuter},
+            {"role": "user", "content": template.format(db_info=db_info, **fields)}
+        ]
+
+    def _finish(self, question: Dict[str, Any], content: str) -> bool:
+        result = json.loads(extract_json_from_response(content))
+        self._save(question, result, "refuter_output.json")
+        return result.get("verdict", None)
+
     def call(self, question: Dict[str, Any], pred_sql: str, pred_result: Any = None, gold_result: Any = None, prover_reason: str = None) -> bool:
         """Validate predicted SQL against gold standard SQL for critical conflicts"""
         try:
-            db_info = get_db_info(question["db_id"], [pred_sql, question["gold_sql"]])
-            
-            if pred_result is not None and gold_result is not None:
+            messages = self._messages(question, pred_sql, pred_result, gold_result, prover_reason)
+            # temperature=0
+            content = chat(self.client, self.model, messages, stream=self.stream, stage="refuter", validate=has_verdict)
+            return self._finish(question, content)
 
-                pred_result = pred_result.head(20)
-                gold_result = gold_result.head(20)
-                
-                user_content = user_prompt_refuter.format(
-                    question=question["question"],
-                    evidence=question.get("evidence", ""),
-                    predicted_sql=pred_sql,
-                    gold_sql=question["gold_sql"],
-                    db_info=db_info,
-                    pred_result=pred_result,
-                    gold_result=gold_result,
-                    prover_reason=prover_reason
-                )
-            else:
-                user_content = user_prompt_refuter_without_results.format(
-                    question=question["question"],
-                    evidence=question.get("evidence", ""),
-                    predicted_sql=pred_sql,
-                    gold_sql=question["gold_sql"],
-                    db_info=db_info,
-                )
-            
-            client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt_refuter},
-                    {"role": "user", "content": user_content}
-                ],
-                # temperature=0
-            )
-            
-            result = json.loads(extract_json_from_response(response.choices[0].message.content))
-            # print(response.choices[0].message.content)
-            # Save output to a single JSON file (append mode)
-            output_data = {
-                "question_id": question["question_id"],
-                "result": result
-            }
-            output_file = os.path.join(self.output_dir, "refuter_output.json")
-            save_json(output_data, output_file, append=True)
+        except Exception as e:
+            record_failure("refuter", e)
+            print(f"Refuter error: {e}")
+            return None
 
-            return result.get("verdict", None)
+    async def acall(self, question: Dict[str, Any], pred_sql: str, pred_result: Any = None, gold_result: Any = None, prover_reason: str = None) -> bool:
+        """Async call: schema lookup and output writes run in a thread, the request on the event loop"""
+        try:
+            messages = await asyncio.to_thread(self._messages, question, pred_sql, pred_result, gold_result, prover_reason)
+            content = await achat(self.async_client or get_async_client(self.model), self.model, messages, stream=self.stream, stage="refuter", validate=has_verdict)
+            return await asyncio.to_thread(self._finish, question, content)
 
         except Exception as e:
+            record_failure("refuter", e)
             print(f"Refuter error: {e}")
             return None
@@ -0,0 +1,99 @@
+import json
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from .llm import get_client
+
+
+def write_batch_requests(path: str, requests: List[Tuple[str, str, List[Dict[str, str]], Dict[str, Any]]]):
+    """Write (custom_id, model, messages, params) requests as OpenAI Batch API input lines"""
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, model, messages, params in requests:
+            line = {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions",
+                    "body": {"model": model, "messages": messages, **params}}
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def read_batch_responses(path: str) -> Dict[str, Optional[str]]:
+    """custom_id -> message content from Batch API output lines; None for requests that failed"""
+    contents = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            response = record.get("response") or {}
+            body = response.get("body") or {}
+            if record.get("error") or response.get("status_code") != 200 or not body.get("choices"):
+                contents[record["custom_id"]] = None
+            else:
+                contents[record["custom_id"]] = body["choices"][0]["message"]["content"]
+    return contents
+
+
+def _run_request(line: str) -> Dict[str, Any]:
+    request = json.loads(line)
+    body = dict(request["body"])
+    model, messages = body.pop("model"), body.pop("messages")
+    try:
+        response = get_client(model).chat.completions.create(model=model, messages=messages, **body)
+    except Exception as e:
+        return {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+    return {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": response.to_dict()}, "error": None}
+
+
+def run_local_batch(requests_path: str, responses_path: str, threads: int = 8) -> int:
+    """File-based stand-in for a batch endpoint: answers every request through the configured chat endpoint"""
+    with open(requests_path, "r", encoding="utf-8") as f:
+        lines = [line for line in f if line.strip()]
+    with ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+        results = list(executor.map(_run_request, lines))
+    with open(responses_path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return sum(1 for r in results if r["error"] is None)
+
+
+def run_canned_batch(requests_path: str, responses_path: str, canned_path: str) -> int:
+    """Offline stand-in for a batch endpoint: answers requests from canned {"custom_id", "content"} JSONL lines.
+
+    Requests without a canned line, or whose line carries an "error", come back failed, as a partial batch would.
+    No network calls are made, so wave advancement can be exercised without an API key.
+    """
+    canned = {}
+    with open(canned_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                canned[record["custom_id"]] = record
+    results = []
+    with open(requests_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            custom_id = json.loads(line)["custom_id"]
+            record = canned.get(custom_id)
+            if record is None or record.get("error"):
+                error = record.get("error") if record else "no canned response"
+                results.append({"custom_id": custom_id, "response": None, "error": {"message": str(error)}})
+            else:
+                body = {"choices": [{"index": 0, "message": {"role": "assistant", "content": record["content"]}}]}
+                results.append({"custom_id": custom_id, "response": {"status_code": 200, "body": body}, "error": None})
+    with open(responses_path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    return sum(1 for r in results if r["error"] is None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a batch request file locally (stand-in for a provider batch endpoint)")
+    parser.add_argument("requests", type=str)
+    parser.add_argument("responses", type=str)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--canned", type=str, default=None, help="Answer from this {custom_id, content} JSONL instead of calling the chat endpoint")
+    args = parser.parse_args()
+    if args.canned:
+        succeeded = run_canned_batch(args.requests, args.responses, args.canned)
+    else:
+        succeeded = run_local_batch(args.requests, args.responses, args.threads)
+    print(f"Answered {succeeded} requests into {args.responses}")
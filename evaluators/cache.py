@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+import pandas as pd
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from .results import ResultSummary, FINGERPRINT_VERSION
+from .utils import _resolve_db_path, atomic_write, run_with_timeout, summarize_sql
+from .connections import file_digest
+from .lexer import tokenize
+
+# Bump whenever normalize_sql or what gets cached changes so entries written by older code are not reused.
+CACHE_KEY_VERSION = 3
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace outside literals, quoted identifiers and comments, and drop trailing semicolons"""
+    parts = []
+    for token in tokenize(sql.strip()):
+        if token.kind == "space":
+            # A "--" comment runs to the end of its line, so the newline ending it must survive.
+            parts.append("\n" if parts and parts[-1].startswith("--") else " ")
+        else:
+            parts.append(token.text)
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+class GoldResultCache:
+    """On-disk, content-addressed cache of gold SQL execution summaries shared across method runs"""
+
+    def __init__(self, cache_dir: str | Path = "cache/gold"):
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, db: str | Path, sql: str, semantics: str) -> Path:
+        db_path = _resolve_db_path(db)
+        key = hashlib.sha256(f"{CACHE_KEY_VERSION}\0{FINGERPRINT_VERSION}\0{semantics}\0{file_digest(db_path)}\0{normalize_sql(sql)}".encode("utf-8")).hexdigest()
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, db: str | Path, sql: str, semantics: str = "bag") -> Optional[ResultSummary]:
+        """Cached summary carrying the semantics fingerprint, None on a miss"""
+        try:
+            with open(self._entry_path(db, sql, semantics), "r", encoding="utf-8") as f:
+                data = ResultSummary.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, db: str | Path, sql: str, result: ResultSummary | bool, semantics: str = "bag"):
+        """Persist a successful summary; execution errors are not stored, so a transient gold failure is retried next run"""
+        if not isinstance(result, ResultSummary) or semantics not in result.fingerprints:
+            return
+        try:
+            path = self._entry_path(db, sql, semantics)
+        except OSError:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = result.to_dict()
+        atomic_write(path, lambda f: json.dump(data, f, ensure_ascii=False, default=str))
+
+    def fetch(self, db: str | Path, sql: str, timeout: float = 120, semantics: str = "bag") -> Optional[ResultSummary | bool]:
+        """Cached summary, or execute sql and cache a successful outcome; False on an execution error, None on a timeout"""
+        cached = self.get(db, sql, semantics)
+        if cached is not None:
+            return cached
+        res = run_with_timeout(summarize_sql, db, sql, semantics, timeout=timeout, cached=False)
+        self.put(db, sql, res, semantics)
+        return res
+
+
+class SQLResultCache:
+    """Two-tier (LRU memory + on-disk) cache of successful execute_sql/summarize_sql outcomes keyed by database hash and SQL.
+
+    Execution errors are never cached: a locked database or a crashed worker must not be replayed on later runs.
+    The memory tier is bounded by the estimated size of the results it holds (max_bytes), the disk tier by the
+    size of its files (max_disk_bytes); both evict least recently used entries first.
+    """
+
+    def __init__(self, cache_dir: str | Path = "cache/sql", max_bytes: int = 512 << 20, max_rows: int = 100_000,
+                 max_disk_bytes: int = 2 << 30):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.max_rows = max_rows
+        self.max_disk_bytes = max_disk_bytes
+        self.memory: OrderedDict = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.saved_seconds = 0.0
+        self.disk_bytes = sum(f.stat().st_size for f in self._disk_entries())
+
+    def _disk_entries(self) -> List[Path]:
+        return list(self.cache_dir.glob("*/*.pkl")) if self.cache_dir.exists() else []
+
+    def _key(self, db_path: Path, sql: str, kind: str) -> str:
+        return hashlib.sha256(f"{kind}\0{CACHE_KEY_VERSION}\0{FINGERPRINT_VERSION}\0{file_digest(db_path)}\0{normalize_sql(sql)}".encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _estimate_bytes(result: Any) -> int:
+        if isinstance(result, pd.DataFrame):
+            return int(result.memory_usage(index=True, deep=True).sum())
+        if isinstance(result, ResultSummary):
+            return int(result.preview.memory_usage(index=True, deep=True).sum()) + 1024
+        return 256
+
+    def _remember(self, key: str, result: Any, elapsed: float):
+        size = self._estimate_bytes(result)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.memory.pop(key, None)
+            if old is not None:
+                self.memory_bytes -= old[2]
+            self.memory[key] = (result, elapsed, size)
+            self.memory_bytes += size
+            while self.memory_bytes > self.max_bytes:
+                _, evicted = self.memory.popitem(last=False)
+                self.memory_bytes -= evicted[2]
+
+    def get(self, db_path: Path, sql: str, kind: str = "execute_sql") -> Optional[pd.DataFrame | ResultSummary | tuple]:
+        """Cached result, None on a miss"""
+        try:
+            key = self._key(db_path, sql, kind)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                self.saved_seconds += entry[1]
+                return entry[0]
+        path = self.cache_dir / key[:2] / f"{key}.pkl"
+        try:
+            with open(path, "rb") as f:
+                result, elapsed = pickle.load(f)
+            # The file's mtime is its last use, which is what disk eviction orders by.
+            os.utime(path)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        self._remember(key, result, elapsed)
+        with self.lock:
+            self.disk_hits += 1
+            self.saved_seconds += elapsed
+        return result
+
+    def put(self, db_path: Path, sql: str, result: pd.DataFrame | ResultSummary | tuple, elapsed: float = 0.0, kind: str = "execute_sql"):
+        """Cache a successful result; None (timeout) and False (execution error) are not stored"""
+        if result is None or result is False or (isinstance(result, pd.DataFrame) and len(result) > self.max_rows):
+            return
+        try:
+            key = self._key(db_path, sql, kind)
+        except OSError:
+            return
+        self._remember(key, result, elapsed)
+        path = self.cache_dir / key[:2] / f"{key}.pkl"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = atomic_write(path, lambda f: pickle.dump((result, elapsed), f, protocol=pickle.HIGHEST_PROTOCOL),
+                            binary=True, max_bytes=self.max_disk_bytes)
+        if size is None:
+            return
+        with self.lock:
+            self.disk_bytes += size
+            if self.disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        """Delete least recently used files until 90% of the disk budget is left; called with the lock held"""
+        entries = []
+        for f in self._disk_entries():
+            try:
+                st = f.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, f))
+        # Other processes may share the directory, so recount instead of trusting the running total.
+        self.disk_bytes = sum(size for _, size, _ in entries)
+        for _, size, f in sorted(entries, key=lambda e: e[0]):
+            if self.disk_bytes <= int(self.max_disk_bytes * 0.9):
+                break
+            try:
+                f.unlink()
+            except OSError:
+                continue
+            self.disk_bytes -= size
+            self.evicted += 1
+
+    def fetch(self, db_path: Path, sql: str, execute: Callable[[], Any], kind: str = "execute_sql") -> Any:
+        cached = self.get(db_path, sql, kind)
+        if cached is not None:
+            return cached
+        start = time.perf_counter()
+        res = execute()
+        self.put(db_path, sql, res, time.perf_counter() - start, kind)
+        return res
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def report(self) -> str:
+        return (f"SQL result cache: {self.memory_hits} memory hits, {self.disk_hits} disk hits, {self.misses} misses "
+                f"(hit ratio {self.hit_ratio:.1%}, ~{self.saved_seconds:.1f}s of SQL execution saved), {self.evicted} evicted from disk")
+
+
+LLM_CACHE_MODES = ("off", "read", "write", "readwrite")
+
+
+class LLMResponseCache:
+    """SQLite-backed cache of chat completion contents keyed by model, messages and sampling parameters"""
+
+    def __init__(self, path: str | Path = "cache/llm.sqlite", mode: str = "readwrite", max_bytes: int = 1 << 30):
+        if mode not in LLM_CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode: {mode}")
+        self.path = Path(path)
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # WAL lets several evaluation processes share one cache file.
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL;")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, model TEXT, content TEXT, size INTEGER, accessed REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+        # Running total of stored content bytes, so puts need no full-table SUM.
+        self.total_bytes = self._count_bytes()
+
+    def _count_bytes(self) -> int:
+        return self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        payload = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]) -> Optional[str]:
+        """Cached response content, or None on a miss or when reads are disabled"""
+        if self.mode not in ("read", "readwrite"):
+            return None
+        key = self.key(model, messages, params)
+        with self.lock:
+            row = self.conn.execute("SELECT content FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+            self.hits += 1
+        return row[0]
+
+    def put(self, model: str, messages: List[Dict[str, str]], params: Dict[str, Any], content: str):
+        if self.mode not in ("write", "readwrite") or content is None:
+            return
+        key = self.key(model, messages, params)
+        size = len(content.encode("utf-8"))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO responses (key, model, content, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                              (key, model, content, size, time.time()))
+            self.writes += 1
+            self.total_bytes += size - (old[0] if old else 0)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Other processes sharing the file also write and evict, so recount before dropping anything.
+        self.total_bytes = self._count_bytes()
+        if self.total_bytes <= self.max_bytes:
+            return
+        # Drop least recently used responses until 90% of the budget is left.
+        target = self.total_bytes - int(self.max_bytes * 0.9)
+        freed = 0
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if freed >= target:
+                break
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            freed += size
+            self.evicted += 1
+        self.total_bytes -= freed
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def report(self) -> str:
+        return (f"LLM response cache ({self.mode}): {self.hits} hits, {self.misses} misses (hit ratio {self.hit_ratio:.1%}), "
+                f"{self.writes} writes, {self.evicted} evicted")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,126 @@
+import os
+import asyncio
+import argparse
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Generator, Iterable, List, Optional
+from .utils import set_result_cache, schema_pruning_report, rendered_schema_cache
+from .cache import SQLResultCache, LLMResponseCache, LLM_CACHE_MODES
+from .executor import SQL_BACKENDS
+from .llm import configure_llm_clients, aclose_llm_clients, set_response_cache, set_telemetry, usage_stats, usage_report
+from .schema import configure_schema_catalog
+from .telemetry import LLMTelemetry, load_prices
+from .ratelimit import configure_rate_limits, rate_limits_enabled, rate_limit_report
+
+
+def add_run_arguments(parser: argparse.ArgumentParser):
+    """Flags shared by main.py and the baselines: SQL execution, caches, async mode, rate limits, prompts and telemetry"""
+    parser.add_argument("--threads", type=int, default=1, help="Number of threads")
+    parser.add_argument("--input", type=str, default="sample.json", help="Input file path")
+    parser.add_argument("--sql-backend", choices=SQL_BACKENDS, default="spawn", help="How SQL is executed under its timeout")
+    parser.add_argument("--sql-workers", type=int, default=0, help="Worker processes for --sql-backend pool (defaults to 2 x --threads: each question runs its predicted and gold SQL at once)")
+    parser.add_argument("--sql-max-ops", type=int, default=None, help="SQLite VM operation budget per query (pool/inprocess)")
+    parser.add_argument("--cache-dir", type=str, default="cache", help="Directory for persistent SQL result and schema catalog caches")
+    parser.add_argument("--no-sql-cache", action="store_true", help="Always re-execute predicted SQL")
+    parser.add_argument("--sql-cache-size-mb", type=int, default=2048, help="Size at which least recently used SQL results are evicted from <cache-dir>/sql")
+    parser.add_argument("--async", dest="async_mode", action="store_true", help="Run questions on an asyncio event loop instead of worker threads")
+    parser.add_argument("--max-inflight", type=int, default=256, help="Questions in flight at once with --async")
+    parser.add_argument("--model-concurrency", type=int, default=64, help="In-flight LLM requests per model with --async")
+    parser.add_argument("--llm-cache", choices=LLM_CACHE_MODES, default="off", help="Reuse/record LLM responses in <cache-dir>/llm.sqlite")
+    parser.add_argument("--llm-cache-size-mb", type=int, default=1024, help="Size at which least recently used LLM responses are evicted")
+    parser.add_argument("--rpm", type=float, default=0, help="Requests per minute allowed per model (0: unlimited)")
+    parser.add_argument("--tpm", type=float, default=0, help="Tokens per minute allowed per model (0: unlimited)")
+    parser.add_argument("--prefix-cache", action="store_true", help="Put the whole database schema before the per-question parts of Prover/Refuter prompts so provider prompt caching applies")
+    parser.add_argument("--prune-schema", action="store_true", help="Send only the columns the SQL references, primary/foreign keys and their neighbors (ignored with --prefix-cache)")
+    parser.add_argument("--schema-neighbors", type=int, default=2, help="Neighboring columns kept on each side of a referenced column with --prune-schema")
+    parser.add_argument("--stream", action="store_true", help="Stream Prover/Refuter answers and close each stream once its JSON verdict is complete")
+    parser.add_argument("--prices", type=str, default=None, help="JSON {model: [prompt, cached prompt, completion]} USD per 1M tokens for the cost estimate")
+    parser.add_argument("--no-telemetry", action="store_true", help="Do not record LLM calls to <output dir>/llm_calls.jsonl")
+
+
+class RunSetup:
+    """LLM clients, rate limits, caches and telemetry configured from add_run_arguments flags; create it before any client"""
+
+    def __init__(self, args: argparse.Namespace, output_dir: str):
+        configure_llm_clients(default_concurrency=args.model_concurrency, max_connections=max(64, args.model_concurrency),
+                              max_keepalive_connections=max(64, args.model_concurrency))
+        configure_rate_limits(default=(args.rpm, args.tpm) if args.rpm or args.tpm else None)
+        if rate_limits_enabled():
+            # The limiter has to see every 429 to adapt, so the client must not retry them on its own.
+            configure_llm_clients(max_retries=0)
+        self.schema_neighbors = args.schema_neighbors if args.prune_schema and not args.prefix_cache else None
+        # Keyword arguments for Prover/Refuter.
+        self.verifier_options = dict(prefix_cache=args.prefix_cache, schema_neighbors=self.schema_neighbors, stream=args.stream)
+        self.sql_cache = None if args.no_sql_cache else SQLResultCache(os.path.join(args.cache_dir, "sql"), max_disk_bytes=args.sql_cache_size_mb << 20)
+        set_result_cache(self.sql_cache)
+        configure_schema_catalog(os.path.join(args.cache_dir, "schema"))
+        self.llm_cache = None if args.llm_cache == "off" else LLMResponseCache(os.path.join(args.cache_dir, "llm.sqlite"), args.llm_cache, args.llm_cache_size_mb << 20)
+        set_response_cache(self.llm_cache)
+        self.telemetry = None if args.no_telemetry else LLMTelemetry(os.path.join(output_dir, "llm_calls.jsonl"), load_prices(args.prices) if args.prices else None)
+        set_telemetry(self.telemetry)
+
+    def report(self):
+        """Print the cache, rate limit, token usage and telemetry reports of the run and close the telemetry file"""
+        if self.sql_cache is not None:
+            print(self.sql_cache.report())
+        if self.llm_cache is not None:
+            print(self.llm_cache.report())
+        if rate_limits_enabled():
+            print(rate_limit_report())
+        if any(usage_stats().values()):
+            print(usage_report())
+        if self.schema_neighbors is not None:
+            print(schema_pruning_report())
+        if rendered_schema_cache.hits or rendered_schema_cache.misses:
+            print(rendered_schema_cache.report())
+        if self.telemetry is not None:
+            print(self.telemetry.summary())
+            self.telemetry.close()
+
+
+_sql_executor: Optional[ThreadPoolExecutor] = None
+
+
+def run_steps(steps: Generator, run_step: Callable[..., Any]) -> Any:
+    """Drive a step generator on this thread: run_step(stage, *args) for each (stage, args) it yields, sending the result back.
+
+    Returns the generator's return value. Sync and async runs share one generator so their scoring logic cannot drift apart.
+    """
+    try:
+        stage, args = next(steps)
+        while True:
+            stage, args = steps.send(run_step(stage, *args))
+    except StopIteration as done:
+        return done.value
+
+
+async def arun_steps(steps: Generator, arun_step: Callable[..., Awaitable[Any]]) -> Any:
+    """run_steps with each step awaited on the running loop"""
+    try:
+        stage, args = next(steps)
+        while True:
+            stage, args = steps.send(await arun_step(stage, *args))
+    except StopIteration as done:
+        return done.value
+
+
+async def run_sql(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """func(*args, **kwargs) on run_bounded's SQL executor, so SQL never queues ahead of the loop's light to_thread work"""
+    return await asyncio.get_running_loop().run_in_executor(_sql_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_bounded(items: Iterable[Any], handle: Callable[[Any, asyncio.Semaphore], Awaitable[Any]], max_inflight: int, sql_threads: int) -> List[Any]:
+    """handle(item, inflight) for every item on the running loop; handle holds inflight while it works on an item.
+
+    SQL sent through run_sql runs on its own sql_threads threads; asyncio.to_thread keeps the loop's default
+    executor. The loop's async LLM clients are closed when every item is done.
+    """
+    global _sql_executor
+    _sql_executor = ThreadPoolExecutor(max_workers=sql_threads, thread_name_prefix="sql-async")
+    inflight = asyncio.Semaphore(max_inflight)
+    try:
+        return await asyncio.gather(*(handle(item, inflight) for item in items))
+    finally:
+        _sql_executor.shutdown(wait=False)
+        _sql_executor = None
+        await aclose_llm_clients()
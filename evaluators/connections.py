@@ -0,0 +1,216 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+from urllib.parse import quote
+
+PROGRESS_HANDLER_STEPS = 1000
+
+_local = threading.local()
+_digest_lock = threading.Lock()
+_digests: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_digest(path: str | Path) -> str:
+    """sha256 of a database file, memoized per (path, size, mtime)"""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _digest_lock:
+        if key in _digests:
+            return _digests[key]
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _digest_lock:
+        _digests[key] = digest
+    return digest
+
+
+class Deadline:
+    """Wall-clock and VM-operation budget, plus an optional cancel event, enforced through sqlite3 progress handlers"""
+
+    def __init__(self, timeout: float, max_ops: int = None, cancel=None):
+        self.expires_at = time.monotonic() + timeout
+        self.max_ops = max_ops
+        self.cancel = cancel
+        self.ops = 0
+        self.expired = False
+
+    def __call__(self) -> int:
+        self.ops += PROGRESS_HANDLER_STEPS
+        if (time.monotonic() >= self.expires_at or (self.max_ops and self.ops > self.max_ops)
+                or (self.cancel is not None and self.cancel.is_set())):
+            self.expired = True
+            return 1
+        return 0
+
+
+@contextmanager
+def sql_deadline(timeout: float, max_ops: int = None, cancel=None):
+    """Interrupt every query this thread runs through db_connection once the budget is spent or cancel is set"""
+    previous = getattr(_local, "deadline", None)
+    deadline = _local.deadline = Deadline(timeout, max_ops, cancel)
+    try:
+        yield deadline
+    finally:
+        _local.deadline = previous
+
+
+class ConnectionPool:
+    """Read-only, immutable, memory-mapped sqlite connections pooled per database file"""
+
+    def __init__(self, mmap_size: int = 1 << 30, cache_size_kib: int = 65536, max_idle: int = 16):
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.max_idle = max_idle
+        self._idle: Dict[str, List[sqlite3.Connection]] = {}
+        self._lock = threading.Lock()
+        # abspath -> (shared-cache memory URI, anchor connection keeping the replica alive, bytes)
+        self._replicas: Dict[str, tuple] = {}
+        self.replica_hits = 0
+        self.replica_misses = 0
+
+    def _open(self, path: str) -> sqlite3.Connection:
+        replica = self._replicas.get(path)
+        if replica is not None:
+            conn = sqlite3.connect(replica[0], uri=True, check_same_thread=False)
+        else:
+            # immutable=1 skips locking and change detection: the evaluation databases never change underneath us.
+            uri = f"file:{quote(Path(path).as_posix())}?mode=ro&immutable=1"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)};")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)};")
+        conn.execute("PRAGMA query_only=ON;")
+        return conn
+
+    def load_replicas(self, db_paths: Iterable[str | Path], budget_bytes: int) -> List[str]:
+        """Copy databases into shared in-memory replicas, in the given order, while they fit the budget"""
+        used = sum(r[2] for r in self._replicas.values())
+        loaded = []
+        for db_path in db_paths:
+            key = os.path.abspath(db_path)
+            if key in self._replicas or not os.path.exists(key) or used + os.path.getsize(key) > budget_bytes:
+                continue
+            uri = f"file:replica{len(self._replicas)}?mode=memory&cache=shared"
+            anchor = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            source = self._open(key)
+            try:
+                source.backup(anchor)
+            except sqlite3.Error as e:
+                print(f"Failed to replicate {key} into memory: {e}")
+                anchor.close()
+                continue
+            finally:
+                source.close()
+            size = anchor.execute("PRAGMA page_count;").fetchone()[0] * anchor.execute("PRAGMA page_size;").fetchone()[0]
+            with self._lock:
+                self._replicas[key] = (uri, anchor, size)
+                stale = self._idle.pop(key, [])
+            for c in stale:
+                c.close()
+            used += size
+            loaded.append(key)
+        return loaded
+
+    def replica_stats(self) -> Dict[str, int]:
+        return {
+            "replicas": len(self._replicas),
+            "replica_bytes": sum(r[2] for r in self._replicas.values()),
+            "hits": self.replica_hits,
+            "misses": self.replica_misses,
+        }
+
+    @contextmanager
+    def connection(self, db_path: str | Path):
+        key = os.path.abspath(db_path)
+        with self._lock:
+            if key in self._replicas:
+                self.replica_hits += 1
+            else:
+                self.replica_misses += 1
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            conn = self._open(key)
+        try:
+            yield conn
+        finally:
+            self._release(key, conn)
+
+    def _release(self, key: str, conn: sqlite3.Connection):
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            return
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle] + [r[1] for r in self._replicas.values()]
+            self._idle.clear()
+            self._replicas.clear()
+        for c in conns:
+            c.close()
+
+
+_pool = ConnectionPool()
+
+
+def configure_connections(mmap_size: int = 1 << 30, cache_size_kib: int = 65536, max_idle: int = 16):
+    global _pool
+    _pool.close()
+    _pool = ConnectionPool(mmap_size, cache_size_kib, max_idle)
+
+
+def select_replicas(question_counts: Dict[str, int], budget_bytes: int) -> List[str]:
+    """Database paths to hold in memory: most-asked first, skipping any that no longer fit the budget"""
+    selected, used = [], 0
+    for path, _ in sorted(question_counts.items(), key=lambda kv: -kv[1]):
+        if not os.path.exists(path):
+            continue
+        size = os.path.getsize(path)
+        if used + size <= budget_bytes:
+            selected.append(path)
+            used += size
+    return selected
+
+
+def load_replicas(db_paths: List[str], budget_bytes: int) -> List[str]:
+    """Replicate db_paths into this process's connection pool; used as the SQL worker initializer"""
+    return _pool.load_replicas(db_paths, budget_bytes)
+
+
+def replica_stats() -> Dict[str, int]:
+    return _pool.replica_stats()
+
+
+@contextmanager
+def _bounded(conn: sqlite3.Connection):
+    deadline = getattr(_local, "deadline", None)
+    if deadline is None:
+        yield conn
+        return
+    conn.set_progress_handler(deadline, PROGRESS_HANDLER_STEPS)
+    try:
+        yield conn
+    finally:
+        conn.set_progress_handler(None, PROGRESS_HANDLER_STEPS)
+
+
+@contextmanager
+def db_connection(db_path: str | Path):
+    """A pooled read-only connection, bounded by the calling thread's sql_deadline if one is active"""
+    with _pool.connection(db_path) as conn, _bounded(conn):
+        yield conn
@@ -0,0 +1,346 @@
+import os
+import time
+import atexit
+import pickle
+import queue
+import secrets
+import threading
+import multiprocessing as mp
+from multiprocessing.connection import wait
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, List, Optional
+from .connections import sql_deadline
+
+SQL_BACKENDS = ("spawn", "pool", "inprocess")
+# Extra time a pooled worker gets to honour its own deadline before it is killed.
+_KILL_GRACE = 2.0
+
+# How often a cancellable wait wakes up to check its cancel event.
+_CANCEL_POLL = 0.05
+
+# Results whose raw buffers are smaller than this travel inline through the pipe.
+_SHM_MIN_BYTES = 1 << 16
+
+# Name of the shared memory block the current task's result goes into, assigned by the parent so it can
+# unlink a block left behind by a worker it kills.
+_result_shm_name: Optional[str] = None
+
+_backend = "spawn"
+_max_ops: Optional[int] = None
+
+
+def run_in_process(func: Callable[..., Any], *args, timeout: float = 2.0, max_ops: int = None, cancel=None, **kwargs) -> Any:
+    """Run func in the calling thread, interrupting its queries once the deadline or op budget is spent or cancel is set"""
+    with sql_deadline(timeout, max_ops, cancel) as deadline:
+        try:
+            res = func(*args, **kwargs)
+        except Exception:
+            res = False
+    return None if deadline.expired else res
+
+
+def _pack_result(res: Any) -> tuple:
+    """Pickle res once with its contiguous array buffers taken out-of-band.
+
+    Only buffers that pickle protocol 5 hands out (numeric, bool and datetime columns) go through a shared
+    memory block; object and string columns stay in the pickle payload and travel through the pipe.
+    When the buffers add up to less than _SHM_MIN_BYTES they are sent inline with the payload instead.
+    """
+    buffers = []
+    payload = pickle.dumps(res, protocol=5, buffer_callback=buffers.append)
+    raw = [b.raw() for b in buffers]
+    total = sum(r.nbytes for r in raw)
+    if total < _SHM_MIN_BYTES:
+        return payload, None, [r.tobytes() for r in raw]
+    shm = SharedMemory(create=True, size=total, name=_result_shm_name)
+    sizes, offset = [], 0
+    for r in raw:
+        shm.buf[offset:offset + r.nbytes] = r
+        offset += r.nbytes
+        sizes.append(r.nbytes)
+    name = shm.name
+    shm.close()
+    return payload, name, sizes
+
+
+def _unpack_result(packed: tuple) -> Any:
+    """Inverse of _pack_result; the third element is the inline buffers, or the buffer sizes in the named block"""
+    payload, name, sizes = packed
+    if name is None:
+        return pickle.loads(payload, buffers=sizes)
+    shm = SharedMemory(name=name)
+    try:
+        buffers, offset = [], 0
+        for size in sizes:
+            buffers.append(bytearray(shm.buf[offset:offset + size]))
+            offset += size
+        return pickle.loads(payload, buffers=buffers)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _new_shm_name() -> str:
+    # Short enough for platforms that cap POSIX shared memory names at 31 characters.
+    return f"sqlx{os.getpid()}_{secrets.token_hex(6)}"
+
+
+def _discard_shm(name: str):
+    """Unlink the block name if a killed or crashed worker left it behind"""
+    try:
+        shm = SharedMemory(name=name)
+    except (FileNotFoundError, OSError):
+        return
+    shm.close()
+    shm.unlink()
+
+
+def _send_result(conn, res: Any):
+    try:
+        packed = _pack_result(res)
+    except Exception:
+        packed = _pack_result(False)
+    conn.send(packed)
+
+
+def _recv_result(conn) -> Any:
+    try:
+        return _unpack_result(conn.recv())
+    except (FileNotFoundError, pickle.UnpicklingError):
+        return False
+
+
+def _worker(conn, func: Callable[..., Any], args: tuple, kwargs: dict, shm_name: str = None):
+    global _result_shm_name
+    _result_shm_name = shm_name
+    try:
+        res = func(*args, **kwargs)
+    except Exception:
+        res = False
+    _send_result(conn, res)
+    conn.close()
+
+
+def _wait_ready(objects: list, timeout: float, cancel: threading.Event = None) -> list:
+    """multiprocessing.connection.wait that also returns early (with []) once cancel is set"""
+    if cancel is None:
+        return wait(objects, timeout)
+    expires_at = time.monotonic() + timeout
+    while not cancel.is_set():
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0:
+            return []
+        ready = wait(objects, min(remaining, _CANCEL_POLL))
+        if ready:
+            return ready
+    return []
+
+
+def run_in_subprocess(func: Callable[..., Any], *args, timeout: float = 2.0, cancel: threading.Event = None, **kwargs) -> Any:
+    ctx = mp.get_context("spawn")
+    reader, writer = ctx.Pipe(duplex=False)
+    shm_name = _new_shm_name()
+    p = ctx.Process(target=_worker, args=(writer, func, args, kwargs, shm_name), daemon=True)
+    p.start()
+    writer.close()
+    try:
+        # Drain the result as soon as it is ready so a large result can never block the child's exit.
+        ready = _wait_ready([reader, p.sentinel], timeout, cancel)
+        if not ready:
+            p.terminate()
+            p.join()
+            return None
+        if reader.poll():
+            return _recv_result(reader)
+        return False
+    except (EOFError, OSError):
+        return False
+    finally:
+        p.join()
+        reader.close()
+        # A child killed or crashed after creating its result block never had it read (and unlinked).
+        _discard_shm(shm_name)
+
+
+def _pool_worker(conn, cancel, initializer: Callable[..., Any] = None, initargs: tuple = ()):
+    global _result_shm_name
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        func, args, kwargs, timeout, max_ops, _result_shm_name = task
+        res = run_in_process(func, *args, timeout=timeout, max_ops=max_ops, cancel=cancel, **kwargs)
+        _send_result(conn, res)
+    conn.close()
+
+
+class SQLWorkerPool:
+    """Long-lived SQL executor processes that keep pooled connections warm and enforce per-query timeouts"""
+
+    def __init__(self, num_workers: int = None, initializer: Callable[..., Any] = None, initargs: tuple = ()):
+        self.ctx = mp.get_context("spawn")
+        self.num_workers = max(1, num_workers or os.cpu_count() or 1)
+        self.initializer = initializer
+        self.initargs = initargs
+        self.recycled = 0
+        self._idle: queue.Queue = queue.Queue()
+        self._closed = False
+        for _ in range(self.num_workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        parent_conn, child_conn = self.ctx.Pipe()
+        # Set by the parent to interrupt the worker's current query without killing the process.
+        cancel = self.ctx.Event()
+        p = self.ctx.Process(target=_pool_worker, args=(child_conn, cancel, self.initializer, self.initargs), daemon=True)
+        p.start()
+        child_conn.close()
+        return p, parent_conn, cancel
+
+    def _recycle(self, worker, shm_name: str = None):
+        p, conn, _ = worker
+        p.terminate()
+        p.join()
+        conn.close()
+        if shm_name is not None:
+            _discard_shm(shm_name)
+        self.recycled += 1
+        if not self._closed:
+            self._idle.put(self._spawn())
+
+    def _acquire(self, timeout: float, cancel: threading.Event = None):
+        """An idle worker, or None once timeout passes or cancel is set first"""
+        expires_at = time.monotonic() + timeout
+        while cancel is None or not cancel.is_set():
+            remaining = expires_at - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                return self._idle.get(timeout=remaining if cancel is None else min(remaining, _CANCEL_POLL))
+            except queue.Empty:
+                pass
+        return None
+
+    def run(self, func: Callable[..., Any], *args, timeout: float = 2.0, max_ops: int = None,
+            cancel: threading.Event = None, **kwargs) -> Any:
+        """Run func in a pooled worker: result on success, False on error, None on timeout or cancellation.
+
+        Time spent waiting for an idle worker counts against timeout.
+        """
+        started = time.monotonic()
+        worker = self._acquire(timeout, cancel)
+        if worker is None:
+            return None
+        timeout -= time.monotonic() - started
+        if timeout <= 0:
+            self._idle.put(worker)
+            return None
+        _, conn, worker_cancel = worker
+        shm_name = _new_shm_name()
+        try:
+            conn.send((func, args, kwargs, timeout, max_ops, shm_name))
+            # Queries are interrupted inside the worker; only a worker stuck outside sqlite gets killed.
+            if not _wait_ready([conn], timeout + _KILL_GRACE, cancel):
+                if cancel is not None and cancel.is_set():
+                    # Interrupt the worker's query; keep the process if it answers within the grace period.
+                    worker_cancel.set()
+                    if conn.poll(_KILL_GRACE):
+                        _recv_result(conn)
+                        worker_cancel.clear()
+                        self._idle.put(worker)
+                        return None
+                self._recycle(worker, shm_name)
+                return None
+            res = _recv_result(conn)
+        except (EOFError, OSError):
+            self._recycle(worker, shm_name)
+            return False
+        self._idle.put(worker)
+        return res
+
+    def broadcast(self, func: Callable[..., Any], *args, timeout: float = 60.0) -> List[Any]:
+        """Run func once on every worker, e.g. to collect per-worker statistics"""
+        workers = [self._idle.get() for _ in range(self.num_workers)]
+        results = []
+        for worker in workers:
+            _, conn, _ = worker
+            try:
+                conn.send((func, args, {}, timeout, None, None))
+                results.append(_recv_result(conn) if conn.poll(timeout + _KILL_GRACE) else None)
+            except (EOFError, OSError):
+                results.append(False)
+            self._idle.put(worker)
+        return results
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                p, conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            p.join(1)
+            if p.is_alive():
+                p.terminate()
+            conn.close()
+
+
+_pool: Optional[SQLWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def init_sql_pool(num_workers: int = None, initializer: Callable[..., Any] = None, initargs: tuple = ()) -> SQLWorkerPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SQLWorkerPool(num_workers, initializer, initargs)
+            atexit.register(_pool.close)
+    return _pool
+
+
+def get_sql_pool() -> Optional[SQLWorkerPool]:
+    return _pool
+
+
+def configure_sql_backend(backend: str = "spawn", workers: int = None, max_ops: int = None,
+                         initializer: Callable[..., Any] = None, initargs: tuple = ()):
+    """Select how run_with_timeout executes SQL: spawn per query, a worker pool, or in-process.
+
+    initializer(*initargs) runs once in every pooled worker, or once in this process for inprocess.
+    """
+    global _backend, _max_ops
+    if backend not in SQL_BACKENDS:
+        raise ValueError(f"Unknown SQL backend: {backend}")
+    _backend, _max_ops = backend, max_ops
+    if backend == "pool":
+        init_sql_pool(workers, initializer, initargs)
+    elif backend == "inprocess" and initializer is not None:
+        initializer(*initargs)
+
+
+def get_sql_backend() -> str:
+    return _backend
+
+
+def run_everywhere(func: Callable[..., Any], *args, timeout: float = 60.0) -> List[Any]:
+    """func's result from every process that executes SQL: each pooled worker, or just this one"""
+    if _backend == "pool":
+        return init_sql_pool().broadcast(func, *args, timeout=timeout)
+    return [func(*args)]
+
+
+def run_on_backend(func: Callable[..., Any], *args, timeout: float = 2.0, cancel: threading.Event = None, **kwargs) -> Any:
+    if _backend == "pool":
+        return init_sql_pool().run(func, *args, timeout=timeout, max_ops=_max_ops, cancel=cancel, **kwargs)
+    if _backend == "inprocess":
+        return run_in_process(func, *args, timeout=timeout, max_ops=_max_ops, cancel=cancel, **kwargs)
+    return run_in_subprocess(func, *args, timeout=timeout, cancel=cancel, **kwargs)
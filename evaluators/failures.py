@@ -0,0 +1,66 @@
+import contextvars
+import openai
+from typing import Optional
+
+LLM_TRANSIENT = "llm_transient"
+LLM_ERROR = "llm_error"
+PARSE_ERROR = "parse_error"
+SQL_TIMEOUT = "sql_timeout"
+SQL_ERROR = "sql_error"
+
+# kind -> (retries allowed within one run, delay in seconds before the first retry, doubled per retry)
+RETRY_POLICY = {
+    LLM_TRANSIENT: (3, 20.0),
+    PARSE_ERROR: (2, 0.0),
+    SQL_TIMEOUT: (1, 0.0),
+    LLM_ERROR: (0, 0.0),
+    SQL_ERROR: (0, 0.0),
+}
+
+
+class Failure:
+    """Why a question could not be scored: failure kind, the stage it happened in and the error message"""
+
+    def __init__(self, kind: str, stage: str, message: str = ""):
+        self.kind = kind
+        self.stage = stage
+        self.message = message
+
+    def __repr__(self) -> str:
+        return f"Failure({self.kind}, {self.stage}, {self.message[:80]!r})"
+
+
+_last_failure: contextvars.ContextVar = contextvars.ContextVar("last_failure", default=None)
+
+
+def classify_exception(e: Exception) -> str:
+    # APITimeoutError subclasses APIConnectionError; 408/409/429 and 5xx are worth retrying, other statuses are not.
+    if isinstance(e, openai.APIConnectionError):
+        return LLM_TRANSIENT
+    if isinstance(e, openai.APIStatusError):
+        return LLM_TRANSIENT if e.status_code >= 500 or e.status_code in (408, 409, 429) else LLM_ERROR
+    if isinstance(e, (ValueError, KeyError, TypeError, AttributeError)):
+        return PARSE_ERROR
+    return LLM_ERROR
+
+
+def record_failure(stage: str, e: Exception):
+    """Remember why stage failed in the current thread/task, for the caller that gets its None verdict"""
+    _last_failure.set(Failure(classify_exception(e), stage, str(e)))
+
+
+def take_failure(stage: str) -> Failure:
+    """The failure stage recorded, or a parse error when it returned no verdict without raising"""
+    failure = _last_failure.get()
+    _last_failure.set(None)
+    if failure is None or failure.stage != stage:
+        return Failure(PARSE_ERROR, stage, "response has no verdict")
+    return failure
+
+
+def retry_delay(kind: str, retries: int) -> Optional[float]:
+    """Seconds to wait before retry number retries + 1 of a failure of this kind, or None when exhausted"""
+    allowed, delay = RETRY_POLICY.get(kind, (0, 0.0))
+    if retries >= allowed:
+        return None
+    return delay * (2 ** retries)
@@ -0,0 +1,52 @@
+import re
+from typing import List, NamedTuple
+
+# One pass over SQL. Quoted identifiers ("..", `..`, [..]) and string literals may be unterminated
+# at the end of the text; a block comment may be too.
+_TOKEN = re.compile(
+    r"(?P<space>\s+)"
+    r"|(?P<comment>--[^\n]*|/\*[\s\S]*?(?:\*/|\Z))"
+    r"|(?P<string>'(?:[^']|'')*'?)"
+    r'|(?P<quoted>"(?:[^"]|"")*"?|`[^`]*`?|\[[^\]]*\]?)'
+    r"|(?P<number>\d[\w.]*)"
+    r"|(?P<name>[^\W\d]\w*)"
+    r"|(?P<punct>.)",
+    re.DOTALL,
+)
+
+
+class Token(NamedTuple):
+    """kind is space, comment, string, quoted, number, name or punct; value is the lower-cased,
+    unquoted identifier for name and quoted tokens and the text itself otherwise"""
+    kind: str
+    text: str
+    value: str
+
+
+def _unquote(text: str) -> str:
+    close = {'"': '"', "`": "`", "[": "]"}[text[0]]
+    body = text[1:-1] if len(text) > 1 and text[-1] == close else text[1:]
+    return body.replace('""', '"') if close == '"' else body
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Tokens of sql in order; joining their text gives sql back"""
+    tokens = []
+    for m in _TOKEN.finditer(sql):
+        kind, text = m.lastgroup, m.group()
+        if kind == "name":
+            value = text.lower()
+        elif kind == "quoted":
+            value = _unquote(text).lower()
+        else:
+            value = text
+        tokens.append(Token(kind, text, value))
+    return tokens
+
+
+def strip_trailing(sql: str) -> str:
+    """sql without the whitespace, comments and semicolons that end it"""
+    tokens = tokenize(sql)
+    while tokens and (tokens[-1].kind in ("space", "comment") or tokens[-1].text == ";"):
+        tokens.pop()
+    return "".join(t.text for t in tokens)
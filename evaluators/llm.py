@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import atexit
+import asyncio
+import threading
+import httpx
+import openai
+from dotenv import load_dotenv
+from typing import Any, Callable, Dict, List, Tuple
+from .utils import extract_json_from_response, JSONObjectScanner
+from .ratelimit import get_rate_limiter, retry_after_seconds, estimate_tokens
+
+load_dotenv()
+
+_settings = {
+    "max_connections": 64,
+    "max_keepalive_connections": 64,
+    # Reasoning models can stay silent for minutes, so idle sockets are kept long and reads wait long.
+    "keepalive_expiry": 300.0,
+    "connect_timeout": 10.0,
+    "read_timeout": 900.0,
+    "max_retries": 2,
+    # In-flight requests allowed per model for async callers; per-model overrides go in model_concurrency.
+    "default_concurrency": 64,
+    "model_concurrency": {},
+}
+_clients: Dict[Tuple[str, str, str], openai.OpenAI] = {}
+_async_clients: Dict[Tuple, openai.AsyncOpenAI] = {}
+_slots: Dict[Tuple, asyncio.Semaphore] = {}
+_lock = threading.Lock()
+_response_cache = None
+_telemetry = None
+# Token usage reported by the API across all requests of this process.
+_usage = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "streams": 0, "early_stops": 0}
+# Attempts per request while a rate limiter absorbs 429/5xx responses.
+THROTTLE_ATTEMPTS = 8
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_settings["max_connections"],
+        max_keepalive_connections=_settings["max_keepalive_connections"],
+        keepalive_expiry=_settings["keepalive_expiry"],
+    )
+
+
+def _timeout() -> openai.Timeout:
+    return openai.Timeout(_settings["read_timeout"], connect=_settings["connect_timeout"])
+
+
+def configure_llm_clients(**settings):
+    """Override connection limits/timeouts for clients created from now on (see _settings for the keys)"""
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"Unknown LLM client settings: {sorted(unknown)}")
+    with _lock:
+        _settings.update(settings)
+
+
+def get_client(model: str = None, api_key: str = None, base_url: str = None) -> openai.OpenAI:
+    """Process-wide OpenAI client per (base_url, api_key, model), sharing one keep-alive connection pool"""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    base_url = base_url or os.getenv("OPENAI_BASE_URL")
+    key = (base_url, api_key, model)
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            http_client = openai.DefaultHttpxClient(limits=_limits(), timeout=_timeout())
+            client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=_settings["max_retries"])
+            _clients[key] = client
+    return client
+
+
+def get_async_client(model: str = None, api_key: str = None, base_url: str = None) -> openai.AsyncOpenAI:
+    """AsyncOpenAI counterpart of get_client; async connection pools belong to the running event loop"""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    base_url = base_url or os.getenv("OPENAI_BASE_URL")
+    key = (id(asyncio.get_running_loop()), base_url, api_key, model)
+    with _lock:
+        client = _async_clients.get(key)
+        if client is None:
+            http_client = openai.DefaultAsyncHttpxClient(limits=_limits(), timeout=_timeout())
+            client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=_settings["max_retries"])
+            _async_clients[key] = client
+    return client
+
+
+def model_slot(model: str) -> asyncio.Semaphore:
+    """Semaphore bounding the in-flight async requests to one model"""
+    key = (id(asyncio.get_running_loop()), model)
+    with _lock:
+        slot = _slots.get(key)
+        if slot is None:
+            slot = _slots[key] = asyncio.Semaphore(_settings["model_concurrency"].get(model, _settings["default_concurrency"]))
+    return slot
+
+
+def set_response_cache(cache):
+    """Install an LLMResponseCache consulted by chat/achat (None disables it)"""
+    global _response_cache
+    _response_cache = cache
+
+
+def get_response_cache():
+    return _response_cache
+
+
+def set_telemetry(telemetry):
+    """Install an LLMTelemetry that records every chat/achat call (None disables it)"""
+    global _telemetry
+    _telemetry = telemetry
+
+
+def get_telemetry():
+    return _telemetry
+
+
+def _cacheable(content: str) -> bool:
+    # Every stage expects a JSON answer; one without it is left uncached so a retry or re-run asks again.
+    try:
+        json.loads(extract_json_from_response(content))
+    except (ValueError, TypeError, AttributeError):
+        return False
+    return True
+
+
+def _throttled(e: openai.APIStatusError) -> bool:
+    return isinstance(e, openai.RateLimitError) or e.status_code >= 500
+
+
+def _usage_tokens(response) -> int:
+    return getattr(getattr(response, "usage", None), "total_tokens", None)
+
+
+def _record_usage(usage):
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    with _lock:
+        _usage["requests"] += 1
+        _usage["prompt_tokens"] += usage.prompt_tokens or 0
+        _usage["completion_tokens"] += usage.completion_tokens or 0
+        _usage["cached_tokens"] += getattr(details, "cached_tokens", None) or 0
+
+
+def _record_stream(stopped_early: bool, usage=None):
+    with _lock:
+        _usage["streams"] += 1
+        _usage["early_stops"] += stopped_early
+        if usage is None:
+            _usage["requests"] += 1
+    _record_usage(usage)
+
+
+def usage_stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_usage)
+
+
+def usage_report() -> str:
+    u = usage_stats()
+    report = (f"LLM usage: {u['requests']} requests, {u['prompt_tokens']} prompt tokens "
+              f"({u['cached_tokens']} served from the provider prompt cache, {u['cached_tokens'] / max(1, u['prompt_tokens']):.1%}), "
+              f"{u['completion_tokens']} completion tokens")
+    if u["streams"]:
+        # Usage arrives in the last chunk, so streams closed early are missing from the token counts above.
+        report += f"; {u['streams']} streamed, {u['early_stops']} closed once their JSON object was complete (not in token counts)"
+    return report
+
+
+def _create(client: openai.OpenAI, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]):
+    limiter = get_rate_limiter(model)
+    if limiter is None:
+        return client.chat.completions.create(model=model, messages=messages, **params), 1
+    estimate = estimate_tokens(messages, params.get("max_tokens") or params.get("max_completion_tokens"))
+    for attempt in range(THROTTLE_ATTEMPTS):
+        time.sleep(limiter.reserve(estimate))
+        try:
+            response = client.chat.completions.create(model=model, messages=messages, **params)
+        except openai.APIStatusError as e:
+            if not _throttled(e) or attempt == THROTTLE_ATTEMPTS - 1:
+                raise
+            limiter.on_throttle(retry_after_seconds(e.response.headers))
+            continue
+        limiter.on_success(estimate, _usage_tokens(response))
+        return response, attempt + 1
+
+
+async def _acreate(client: openai.AsyncOpenAI, model: str, messages: List[Dict[str, str]], params: Dict[str, Any]):
+    limiter = get_rate_limiter(model)
+    if limiter is None:
+        return await client.chat.completions.create(model=model, messages=messages, **params), 1
+    estimate = estimate_tokens(messages, params.get("max_tokens") or params.get("max_completion_tokens"))
+    for attempt in range(THROTTLE_ATTEMPTS):
+        await asyncio.sleep(limiter.reserve(estimate))
+        try:
+            response = await client.chat.completions.create(model=model, messages=messages, **params)
+        except openai.APIStatusError as e:
+            if not _throttled(e) or attempt == THROTTLE_ATTEMPTS - 1:
+                raise
+            limiter.on_throttle(retry_after_seconds(e.response.headers))
+            continue
+        limiter.on_success(estimate, _usage_tokens(response))
+        return response, attempt + 1
+
+
+def _read_stream(stream, required_key: str = None) -> tuple:
+    """(text, usage) of a streamed completion; the stream is closed as soon as a JSON object holding required_key is read.
+
+    Usage only arrives in the final chunk, so it is None for a stream closed early.
+    """
+    scanner, usage = JSONObjectScanner(required_key), None
+    try:
+        for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                obj = scanner.feed(chunk.choices[0].delta.content)
+                if obj is not None:
+                    _record_stream(True)
+                    return obj, None
+    finally:
+        stream.close()
+    _record_stream(False, usage)
+    return scanner.text, usage
+
+
+async def _aread_stream(stream, required_key: str = None) -> tuple:
+    scanner, usage = JSONObjectScanner(required_key), None
+    try:
+        async for chunk in stream:
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                obj = scanner.feed(chunk.choices[0].delta.content)
+                if obj is not None:
+                    _record_stream(True)
+                    return obj, None
+    finally:
+        await stream.close()
+    _record_stream(False, usage)
+    return scanner.text, usage
+
+
+def _stream_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    # include_usage adds a final chunk with token counts, read whenever the stream runs to its end.
+    return {**params, "stream": True, "stream_options": {"include_usage": True}}
+
+
+def chat(client: openai.OpenAI, model: str, messages: List[Dict[str, str]], stream: bool = False, stage: str = None, stream_key: str = "verdict", validate: Callable[[str], bool] = None, **params: Any) -> str:
+    """Content of a single chat completion, served from the response cache when installed.
+
+    With stream=True the answer is read as it is generated and the request is abandoned as soon as it
+    holds a complete JSON object with a stream_key key; for stages that expect one such object and
+    ignore anything after it. Only content passing validate (default: it holds parsable JSON) is
+    cached, so an answer the caller rejects is asked again on retry. stage only labels the call in telemetry.
+    """
+    cache, telemetry = _response_cache, _telemetry
+    started = time.perf_counter()
+    if cache is not None:
+        content = cache.get(model, messages, params)
+        if content is not None:
+            if telemetry is not None:
+                telemetry.record(stage, model, "cache", time.perf_counter() - started)
+            return content
+    try:
+        if stream:
+            response, attempts = _create(client, model, messages, _stream_params(params))
+            content, usage = _read_stream(response, stream_key)
+        else:
+            response, attempts = _create(client, model, messages, params)
+            usage = getattr(response, "usage", None)
+            _record_usage(usage)
+            content = response.choices[0].message.content
+    except Exception as e:
+        if telemetry is not None:
+            telemetry.record(stage, model, "stream" if stream else "api", time.perf_counter() - started, error=e)
+        raise
+    if telemetry is not None:
+        telemetry.record(stage, model, "stream" if stream else "api", time.perf_counter() - started, usage, attempts)
+    if cache is not None and (validate or _cacheable)(content):
+        cache.put(model, messages, params, content)
+    return content
+
+
+async def achat(client: openai.AsyncOpenAI, model: str, messages: List[Dict[str, str]], stream: bool = False, stage: str = None, stream_key: str = "verdict", validate: Callable[[str], bool] = None, **params: Any) -> str:
+    cache, telemetry = _response_cache, _telemetry
+    started = time.perf_counter()
+    if cache is not None:
+        content = await asyncio.to_thread(cache.get, model, messages, params)
+        if content is not None:
+            if telemetry is not None:
+                telemetry.record(stage, model, "cache", time.perf_counter() - started)
+            return content
+    async with model_slot(model):
+        # Latency is measured from the start so time spent waiting for a model slot is included.
+        try:
+            if stream:
+                response, attempts = await _acreate(client, model, messages, _stream_params(params))
+                content, usage = await _aread_stream(response, stream_key)
+            else:
+                response, attempts = await _acreate(client, model, messages, params)
+                usage = getattr(response, "usage", None)
+                _record_usage(usage)
+                content = response.choices[0].message.content
+        except Exception as e:
+            if telemetry is not None:
+                telemetry.record(stage, model, "stream" if stream else "api", time.perf_counter() - started, error=e)
+            raise
+    if telemetry is not None:
+        telemetry.record(stage, model, "stream" if stream else "api", time.perf_counter() - started, usage, attempts)
+    if cache is not None and (validate or _cacheable)(content):
+        await asyncio.to_thread(cache.put, model, messages, params, content)
+    return content
+
+
+async def aclose_llm_clients():
+    """Close the async clients of the running loop; call before the loop shuts down"""
+    loop_id = id(asyncio.get_running_loop())
+    with _lock:
+        keys = [k for k in _async_clients if k[0] == loop_id]
+        clients = [_async_clients.pop(k) for k in keys]
+        for k in [k for k in _slots if k[0] == loop_id]:
+            del _slots[k]
+    for client in clients:
+        await client.close()
+
+
+def close_llm_clients():
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+atexit.register(close_llm_clients)
@@ -1,15 +1,18 @@
 import json
 import os
+import asyncio
 import openai
 from dotenv import load_dotenv
 from prompts.prompt_grader import system_prompt_grader, user_prompt_grader
-from ..utils import extract_json_from_response, save_json
+from ..llm import get_client, get_async_client, chat, achat
+from ..utils import extract_json_from_response, save_json, is_json_array
 
 load_dotenv()
 
 class Grader:
-    def __init__(self, question_obj: dict, rubric_questions: list, output_dir: str = "grader_outputs", model: str = "deepseek-chat"):
-        self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
+    def __init__(self, question_obj: dict, rubric_questions: list, output_dir: str = "grader_outputs", model: str = "deepseek-chat", client: openai.OpenAI = None, async_client: openai.AsyncOpenAI = None):
+        self.client = client or get_client(model)
+        self.async_client = async_client
         self.model = model
         self.schema = question_obj["schema"]
         self.question_id = question_obj["question_id"]
@@ -19,7 +22,7 @@ class Grader:
         self.output_dir = output_dir
         os.makedirs(self.output_dir, exist_ok=True)
     
-    def call(self, predicted_sql):        
+    def _messages(self, predicted_sql):
         user_prompt = user_prompt_grader.format(
             question=self.question,
             schema=self.schema,
@@ -27,17 +30,20 @@ class Grader:
             rubric_questions=self.rubric_questions,
             predicted_sql=predicted_sql
         )
-        
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt_grader},
-                {"role": "user", "content": user_prompt}
-            ],
-            temperature=0
-        )
-        response_content = response.choices[0].message.content
-        
+        return [
+            {"role": "system", "content": system_prompt_grader},
+            {"role": "user", "content": user_prompt}
+        ]
+
+    def call(self, predicted_sql):        
+        response_content = chat(self.client, self.model, self._messages(predicted_sql), stage="grader", validate=is_json_array, temperature=0)
+        return self._parse(response_content)
+
+    async def acall(self, predicted_sql):
+        response_content = await achat(self.async_client or get_async_client(self.model), self.model, self._messages(predicted_sql), stage="grader", validate=is_json_array, temperature=0)
+        return await asyncio.to_thread(self._parse, response_content)
+
+    def _parse(self, response_content):
         try:
             answer = extract_json_from_response(response_content)
             grading_results = json.loads(answer)
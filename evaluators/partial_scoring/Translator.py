@@ -1,15 +1,19 @@
 import os
 import json
+import asyncio
 import openai
 from dotenv import load_dotenv
 from prompts.prompt_translator import system_prompt_translator, user_prompt_translator, rubric_templates
-from ..utils import extract_json_from_response, save_json
+from ..llm import get_client, get_async_client, chat, achat
+from ..utils import extract_json_from_response, save_json, is_json_array
 
 load_dotenv()
 
 class Translator:
-    def __init__(self, question_obj: dict, constraints: list, output_dir: str = "translator_outputs", model: str = "deepseek-chat"):
+    def __init__(self, question_obj: dict, constraints: list, output_dir: str = "translator_outputs", model: str = "deepseek-chat", client: openai.OpenAI = None, async_client: openai.AsyncOpenAI = None):
         self.model = model
+        self.client = client or get_client(model)
+        self.async_client = async_client
         self.schema = question_obj["schema"]
         self.question_id = question_obj["question_id"]
         self.question = question_obj["question"]
@@ -19,7 +23,7 @@ class Translator:
         self.output_dir = output_dir
         os.makedirs(self.output_dir, exist_ok=True)
 
-    def call(self) -> list:
+    def _messages(self) -> list:
         constraint_descriptions = self.build_constraint_description(self.constraints)
         user_content = user_prompt_translator.format(
             schema=self.schema,
@@ -28,18 +32,20 @@ class Translator:
             gold_sql=self.gold_sql,
             constraint_descriptions=constraint_descriptions
         )
+        return [
+            {"role": "system", "content": system_prompt_translator},
+            {"role": "user", "content": user_content}
+        ]
 
-        client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL"))
-        response = client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": system_prompt_translator},
-                {"role": "user", "content": user_content}
-            ],
-            temperature=0
-        )
-        response_content = response.choices[0].message.content
+    def call(self) -> list:
+        response_content = chat(self.client, self.model, self._messages(), stage="translator", validate=is_json_array, temperature=0)
+        return self._parse(response_content)
+
+    async def acall(self) -> list:
+        response_content = await achat(self.async_client or get_async_client(self.model), self.model, self._messages(), stage="translator", validate=is_json_array, temperature=0)
+        return await asyncio.to_thread(self._parse, response_content)
 
+    def _parse(self, response_content: str) -> list:
         try:
             answer = extract_json_from_response(response_content)
             designed_rubric = json.loads(answer)
@@ -0,0 +1,24 @@
+from typing import Any, Dict, List
+from .utils import get_full_db_info
+
+DB_INFO_SECTION = "###### Database Information\n{db_info}\n\n"
+
+
+def per_question_template(template: str) -> str:
+    """The user prompt template without its Database Information section"""
+    if DB_INFO_SECTION not in template:
+        raise ValueError("template has no Database Information section")
+    return template.replace(DB_INFO_SECTION, "")
+
+
+def prefix_cached_messages(system_prompt: str, db_id: str, template: str, **fields: Any) -> List[Dict[str, str]]:
+    """Static parts first (system prompt, then the whole database's schema), per-question parts last.
+
+    Every request on the same database then starts with an identical prefix that the provider's
+    prompt cache can serve, instead of diverging at the question text.
+    """
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": "###### Database Information\n" + get_full_db_info(db_id)},
+        {"role": "user", "content": per_question_template(template).format(**fields)},
+    ]
@@ -0,0 +1,155 @@
+import time
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Tuple
+
+
+class _Bucket:
+    """Token bucket refilled continuously at per_minute/60 per second, holding at most burst_seconds of refill"""
+
+    def __init__(self, per_minute: float, burst_seconds: float):
+        self.per_minute = per_minute
+        self.burst_seconds = burst_seconds
+        self.level = self.capacity(1.0)
+        self.updated = time.monotonic()
+
+    def capacity(self, factor: float) -> float:
+        return self.per_minute * factor * self.burst_seconds / 60.0
+
+    def reserve(self, amount: float, factor: float, now: float) -> float:
+        """Take amount (possibly into debt) and return the seconds to wait until the debt is repaid"""
+        rate = self.per_minute * factor / 60.0
+        self.level = min(self.capacity(factor), self.level + (now - self.updated) * rate)
+        self.updated = now
+        self.level -= amount
+        return 0.0 if self.level >= 0 else -self.level / rate
+
+    def refund(self, amount: float, factor: float):
+        self.level = min(self.capacity(factor), self.level + amount)
+
+
+class RateLimiter:
+    """RPM/TPM budgets for one model with AIMD on the allowed rate and Retry-After pauses.
+
+    A throttle (429/5xx) multiplies the allowed fraction of the configured limits by decrease, at most
+    once per burst window since concurrent requests are throttled together; every success adds increase back.
+    """
+
+    def __init__(self, rpm: float = None, tpm: float = None, burst_seconds: float = 10.0,
+                 increase: float = 0.02, decrease: float = 0.5, min_factor: float = 0.05):
+        self.requests = _Bucket(rpm, burst_seconds) if rpm else None
+        self.tokens = _Bucket(tpm, burst_seconds) if tpm else None
+        self.increase = increase
+        self.decrease = decrease
+        self.min_factor = min_factor
+        self.factor = 1.0
+        self.paused_until = 0.0
+        self.burst_seconds = burst_seconds
+        self.decreased_at = float("-inf")
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttles = 0
+        self.waited = 0.0
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """Seconds the caller must wait before sending a request of about estimated_tokens"""
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, self.factor, now))
+            if self.tokens is not None:
+                wait = max(wait, self.tokens.reserve(estimated_tokens, self.factor, now))
+            self.calls += 1
+            self.waited += wait
+        return wait
+
+    def on_success(self, estimated_tokens: int, used_tokens: Optional[int]):
+        with self.lock:
+            self.factor = min(1.0, self.factor + self.increase)
+            if self.tokens is not None and used_tokens is not None:
+                # Settle the reservation against the usage the provider reported.
+                self.tokens.refund(estimated_tokens - used_tokens, self.factor)
+
+    def on_throttle(self, retry_after: Optional[float]):
+        with self.lock:
+            self.throttles += 1
+            now = time.monotonic()
+            if now - self.decreased_at >= self.burst_seconds:
+                self.factor = max(self.min_factor, self.factor * self.decrease)
+                self.decreased_at = now
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+    def stats(self) -> Dict[str, float]:
+        return {"calls": self.calls, "throttles": self.throttles, "waited": self.waited, "factor": self.factor}
+
+
+_default_limits: Optional[Tuple[float, float]] = None
+_model_limits: Dict[str, Tuple[float, float]] = {}
+_limiters: Dict[str, RateLimiter] = {}
+_lock = threading.Lock()
+
+
+def configure_rate_limits(default: Tuple[float, float] = None, per_model: Dict[str, Tuple[float, float]] = None):
+    """Set (rpm, tpm) limits for every model and/or per model; a zero or None entry leaves that budget unlimited"""
+    global _default_limits
+    with _lock:
+        _default_limits = default
+        _model_limits.clear()
+        _model_limits.update(per_model or {})
+        _limiters.clear()
+
+
+def rate_limits_enabled() -> bool:
+    return bool(_default_limits or _model_limits)
+
+
+def get_rate_limiter(model: str) -> Optional[RateLimiter]:
+    with _lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limits = _model_limits.get(model, _default_limits)
+            if not limits or not any(limits):
+                return None
+            limiter = _limiters[model] = RateLimiter(*limits)
+    return limiter
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Delay requested by retry-after-ms / retry-after (seconds or an HTTP date) response headers"""
+    if headers is None:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(messages: List[Dict[str, str]], max_tokens: int = None) -> int:
+    # About four characters per token for the prompt, plus the completion allowance.
+    return sum(len(m.get("content") or "") for m in messages) // 4 + (max_tokens or 1000)
+
+
+def rate_limit_report() -> str:
+    with _lock:
+        limiters = dict(_limiters)
+    lines = []
+    for model, limiter in sorted(limiters.items()):
+        s = limiter.stats()
+        lines.append(f"Rate limiter [{model}]: {s['calls']} calls, {s['throttles']} throttled, "
+                     f"{s['waited']:.1f}s waited, at {s['factor']:.0%} of the configured limits")
+    return "\n".join(lines)
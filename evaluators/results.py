@@ -0,0 +1,312 @@
+import re
+import hashlib
+import numpy as np
+import pandas as pd
+from pandas.util import hash_pandas_object
+from pandas.api.types import infer_dtype
+from typing import Any, Dict, List
+
+PREVIEW_ROWS = 20
+FETCH_SIZE = 10_000
+# Bump whenever cell hashing or the fingerprint combiners change so persisted fingerprints are not reused.
+FINGERPRINT_VERSION = 6
+SEMANTICS = ("set", "bag", "list")
+_FNV_PRIME = np.uint64(1099511628211)
+_NULL_HASH = np.uint64(0x9E3779B97F4A7C15)
+_FLOAT_TAG = np.uint64(0x5851F42D4C957F2D)
+_STR_TAG = np.uint64(0x14057B7EF767814F)
+_OTHER_TAG = np.uint64(0xD6E8FEB86659FD93)
+_LANE_KEYS = (np.uint64(0xA0761D6478BD642F), np.uint64(0xE7037ED1A0B428DB))
+_MASK64 = (1 << 64) - 1
+_INT_TYPES = (int, np.integer)
+_FLOAT_TYPES = (float, np.floating)
+# Text that str() of an int or float produces; only such text is hashed as the number it spells.
+_NUMBER_TEXT = re.compile(r"-?\d+(?:\.\d+)?(?:e[+-]\d+)?")
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    # splitmix64 finalizer; uint64 arithmetic wraps around.
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _hash_ints(a: np.ndarray) -> np.ndarray:
+    return _mix64(a.astype(np.int64).view(np.uint64))
+
+
+def _hash_floats(a: np.ndarray) -> np.ndarray:
+    # Integral floats hash as the equal int (1.0 == 1), NaN hashes as NULL.
+    a = a.astype(np.float64)
+    out = np.full(len(a), _NULL_HASH, dtype=np.uint64)
+    present = ~np.isnan(a)
+    with np.errstate(invalid="ignore"):
+        integral = present & (np.floor(a) == a) & (np.abs(a) < 2.0 ** 63)
+    out[integral] = _hash_ints(a[integral])
+    frac = present & ~integral
+    out[frac] = _mix64(a[frac].view(np.uint64) ^ _FLOAT_TAG)
+    return out
+
+
+def _hash_strings(a: np.ndarray) -> np.ndarray:
+    return _mix64(hash_pandas_object(pd.Series(a, dtype=object), index=False).to_numpy() ^ _STR_TAG)
+
+
+def _number_of(text: str):
+    """The int or float whose str() is text, or None"""
+    try:
+        number = int(text)
+    except ValueError:
+        number = float(text)
+    return number if str(number) == text else None
+
+
+def _hash_text(a: np.ndarray) -> np.ndarray:
+    # As with the str() hashing this replaced, text equals the number it spells ('1' == 1, '1.5' == 1.5);
+    # other spellings such as '01' or '1.50' stay text.
+    h = _hash_strings(a)
+    # Screen on the first character in bulk; only cells starting like a number are checked exactly.
+    first = a.astype("U1")
+    idx = np.flatnonzero(np.char.isdigit(first) | (first == "-"))
+    if len(idx):
+        numbers = [_number_of(v) if _NUMBER_TEXT.fullmatch(v) else None for v in a[idx]]
+        keep = np.array([n is not None for n in numbers], dtype=bool)
+        if keep.any():
+            h[idx[keep]] = _hash_numbers(np.array([n for n in numbers if n is not None], dtype=object))
+    return h
+
+
+def _hash_numbers(values: np.ndarray) -> np.ndarray:
+    # Ints are hashed exactly (float64 would merge 2**53 + 1 with 2**53); floats equal to an int still hash as that int.
+    is_int = np.fromiter((isinstance(v, _INT_TYPES) for v in values), dtype=bool, count=len(values))
+    # Beyond int64 (not produced by SQLite, but text may spell it): hash the decimal text.
+    is_big = np.fromiter((isinstance(v, _INT_TYPES) and not -2 ** 63 <= int(v) < 2 ** 63 for v in values), dtype=bool, count=len(values))
+    is_int &= ~is_big
+    h = np.empty(len(values), dtype=np.uint64)
+    h[is_int] = _hash_ints(np.array([int(v) for v in values[is_int]], dtype=np.int64))
+    h[is_big] = _hash_strings(np.array([str(int(v)) for v in values[is_big]], dtype=object)) ^ _OTHER_TAG
+    rest = ~(is_int | is_big)
+    h[rest] = _hash_floats(values[rest].astype(np.float64))
+    return h
+
+
+def _hash_objects(a: np.ndarray) -> np.ndarray:
+    out = np.full(len(a), _NULL_HASH, dtype=np.uint64)
+    present = ~pd.isna(a)
+    if not present.any():
+        return out
+    values = a[present]
+    kind = infer_dtype(values, skipna=False)
+    if kind == "string":
+        out[present] = _hash_text(values)
+    elif kind in ("integer", "boolean"):
+        out[present] = _hash_ints(values.astype(np.int64))
+    elif kind == "floating":
+        out[present] = _hash_floats(values.astype(np.float64))
+    elif kind == "mixed-integer-float":
+        out[present] = _hash_numbers(values)
+    else:
+        # SQLite's dynamic typing can mix storage classes in one column: hash each class in bulk.
+        is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+        is_num = np.fromiter((isinstance(v, (_INT_TYPES, _FLOAT_TYPES)) for v in values), dtype=bool, count=len(values))
+        is_other = ~(is_str | is_num)
+        h = np.empty(len(values), dtype=np.uint64)
+        h[is_str] = _hash_text(values[is_str])
+        h[is_num] = _hash_numbers(values[is_num])
+        others = np.array([v.hex() if isinstance(v, bytes) else repr(v) for v in values[is_other]], dtype=object)
+        h[is_other] = _hash_strings(others) ^ _OTHER_TAG
+        out[present] = h
+    return out
+
+
+def hash_values(values: np.ndarray | pd.Series) -> np.ndarray:
+    """Per-cell hashes: NULLs collide, 1 == 1.0 == True, and text equals the number it spells ('1' == 1, '01' != 1)"""
+    if isinstance(values, pd.Series):
+        dtype = values.dtype
+        if dtype.kind in "biu":
+            return _hash_ints(values.to_numpy())
+        if dtype.kind == "f":
+            return _hash_floats(values.to_numpy())
+        values = values.to_numpy(dtype=object)
+    elif values.dtype.kind in "biu":
+        return _hash_ints(values)
+    elif values.dtype.kind == "f":
+        return _hash_floats(values)
+    return _hash_objects(np.asarray(values, dtype=object))
+
+
+def _row_hashes(column_hashes: List[np.ndarray], num_rows: int, column_order: bool) -> np.ndarray:
+    h = np.zeros(num_rows, dtype=np.uint64)
+    for c in column_hashes:
+        # Positional (Horner) combine keeps tuples ordered; a sum of mixed hashes matches columns by content.
+        h = _mix64(h * _FNV_PRIME + c) if column_order else h + _mix64(c)
+    return h
+
+
+class ResultFingerprint:
+    """Streaming result fingerprint under set, bag (multiset) or ordered-list row semantics.
+
+    bag and list need constant memory; set has to remember every distinct row hash (8 bytes per
+    distinct row), so it is only built when a caller asks for set semantics.
+    """
+
+    def __init__(self, semantics: str = "bag", column_order: bool = True):
+        if semantics not in SEMANTICS:
+            raise ValueError(f"Unknown fingerprint semantics: {semantics}")
+        self.semantics = semantics
+        self.column_order = column_order
+        self.count = 0
+        self._lanes = [0, 0]
+        self._ordered = hashlib.blake2b(digest_size=16)
+        # Sorted distinct row hashes (8 bytes per distinct row) are only kept for set semantics.
+        self._distinct = np.empty(0, dtype=np.uint64)
+        self._pending: List[np.ndarray] = []
+        self._pending_size = 0
+
+    def _add_to_lanes(self, row_hashes: np.ndarray):
+        # Commutative, duplicate-preserving combiner: two independent 64-bit sums of mixed row hashes.
+        for i, key in enumerate(_LANE_KEYS):
+            self._lanes[i] = (self._lanes[i] + int(_mix64(row_hashes ^ key).sum(dtype=np.uint64))) & _MASK64
+
+    def update(self, column_hashes: List[np.ndarray], num_rows: int):
+        if num_rows == 0:
+            return
+        row_hashes = _row_hashes(column_hashes, num_rows, self.column_order)
+        if self.semantics == "bag":
+            self._add_to_lanes(row_hashes)
+            self.count += num_rows
+        elif self.semantics == "list":
+            self._ordered.update(row_hashes.tobytes())
+            self.count += num_rows
+        else:
+            distinct = np.unique(row_hashes)
+            self._pending.append(distinct)
+            self._pending_size += len(distinct)
+            if self._pending_size >= max(len(self._distinct), 1 << 20):
+                self._merge_distinct()
+
+    def _merge_distinct(self):
+        if self._pending:
+            self._distinct = np.unique(np.concatenate([self._distinct, *self._pending]))
+            self._pending, self._pending_size = [], 0
+
+    def hexdigest(self) -> str:
+        if self.semantics == "list":
+            return f"{self.count}:{self._ordered.hexdigest()}"
+        if self.semantics == "set":
+            self._merge_distinct()
+            self._lanes = [0, 0]
+            self._add_to_lanes(self._distinct)
+            self.count = len(self._distinct)
+        return f"{self.count}:{self._lanes[0]:016x}{self._lanes[1]:016x}"
+
+
+# Named comparators: "bag" is compare_result's default (rows as a multiset, columns matched by
+# content), "set" is BIRD EX (set of ordered tuples), "list" also requires identical row order.
+COMPARATORS = {"bag": ("bag", False), "set": ("set", True), "list": ("list", True)}
+
+
+def hash_dataframe(df: pd.DataFrame, semantics: str = "bag") -> str:
+    fp = ResultFingerprint(*COMPARATORS[semantics])
+    fp.update([hash_values(df.iloc[:, i]) for i in range(df.shape[1])], len(df))
+    return fp.hexdigest()
+
+
+def _merge_dtype(a: str, b: str) -> str:
+    if a == b:
+        return a
+    if {a, b} <= {"int64", "float64"}:
+        return "float64"
+    return "object"
+
+
+class ResultAccumulator:
+    """Builds a ResultSummary from row chunks without holding more than one chunk in memory.
+
+    Only the fingerprint of the requested comparator is built; see ResultFingerprint for the memory set needs.
+    """
+
+    def __init__(self, columns: List[str], preview_rows: int = PREVIEW_ROWS, semantics: str = "bag"):
+        if semantics not in COMPARATORS:
+            raise ValueError(f"Unknown comparator: {semantics}")
+        self.columns = list(columns)
+        self.preview_rows = preview_rows
+        self.preview: List[tuple] = []
+        self.fingerprints = {semantics: ResultFingerprint(*COMPARATORS[semantics])}
+        self.row_count = 0
+        self.column_types: List[str] = None
+
+    def add(self, rows: List[tuple]):
+        if not rows:
+            return
+        df = pd.DataFrame.from_records(rows, columns=self.columns, coerce_float=True)
+        column_hashes = [hash_values(df.iloc[:, i]) for i in range(df.shape[1])]
+        for fp in self.fingerprints.values():
+            fp.update(column_hashes, len(df))
+        types = [str(t) for t in df.dtypes]
+        self.column_types = types if self.column_types is None else [_merge_dtype(a, b) for a, b in zip(self.column_types, types)]
+        if len(self.preview) < self.preview_rows:
+            self.preview.extend(rows[:self.preview_rows - len(self.preview)])
+        self.row_count += len(rows)
+
+    def summary(self) -> "ResultSummary":
+        preview = pd.DataFrame.from_records(self.preview, columns=self.columns, coerce_float=True)
+        return ResultSummary(
+            fingerprints={name: fp.hexdigest() for name, fp in self.fingerprints.items()},
+            row_count=self.row_count,
+            columns=self.columns,
+            column_types=self.column_types or [str(t) for t in preview.dtypes],
+            preview=preview,
+        )
+
+
+class ResultSummary:
+    """Fingerprints, shape, column types and a bounded preview of an executed query"""
+
+    def __init__(self, fingerprints: Dict[str, str], row_count: int, columns: List[str], column_types: List[str], preview: pd.DataFrame):
+        self.fingerprints = fingerprints
+        self.row_count = row_count
+        self.columns = columns
+        self.column_types = column_types
+        self.preview = preview
+
+    @classmethod
+    def from_rows(cls, rows: List[tuple], columns: List[str], preview_rows: int = PREVIEW_ROWS, semantics: str = "bag") -> "ResultSummary":
+        acc = ResultAccumulator(columns, preview_rows, semantics)
+        for i in range(0, len(rows), FETCH_SIZE):
+            acc.add(rows[i:i + FETCH_SIZE])
+        return acc.summary()
+
+    @property
+    def shape(self) -> tuple:
+        return (self.row_count, len(self.columns))
+
+    @property
+    def complete(self) -> bool:
+        return len(self.preview) >= self.row_count
+
+    def head(self, n: int = 5) -> pd.DataFrame:
+        return self.preview.head(n)
+
+    def to_dict(self) -> Dict[str, Any]:
+        preview = self.preview.astype(object).where(self.preview.notna(), None)
+        return {
+            "fingerprints": self.fingerprints,
+            "row_count": self.row_count,
+            "columns": self.columns,
+            "column_types": self.column_types,
+            "preview": preview.values.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ResultSummary":
+        preview = pd.DataFrame(data["preview"], columns=data["columns"])
+        return cls(data["fingerprints"], data["row_count"], data["columns"], data["column_types"], preview)
+
+
+def fingerprint_of(res: pd.DataFrame | ResultSummary, semantics: str = "bag") -> str:
+    if not isinstance(res, ResultSummary):
+        return hash_dataframe(res, semantics)
+    if semantics not in res.fingerprints:
+        raise ValueError(f"result was summarized without a {semantics} fingerprint")
+    return res.fingerprints[semantics]
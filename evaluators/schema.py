@@ -0,0 +1,240 @@
+import os
+import json
+import hashlib
+import threading
+from copy import deepcopy
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from .connections import db_connection, file_digest
+from .lexer import tokenize
+
+# Bump whenever the catalog layout changes so cached catalogs are rebuilt.
+CATALOG_VERSION = 1
+
+# Words that end a FROM list; ORDER and GROUP only when BY follows.
+_CLAUSE_KEYWORDS = {"where", "group", "order", "having", "limit", "union", "intersect", "except", "window", "select", "values"}
+
+_catalog_dir = Path("cache/schema")
+_catalogs: Dict[str, "SchemaCatalog"] = {}
+_locks: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+
+
+class SchemaCatalog:
+    """Tables, columns, keys, DDL and column descriptions of one database, introspected once.
+
+    columns[table] holds [name, type, notnull, pk] rows in declaration order (pk is the 1-based
+    position in the primary key, 0 otherwise), foreign_keys[table] holds [column, ref_table, ref_column]
+    rows, unique[table] the columns with a single-column unique index. all_tables includes SQLite's
+    internal tables; tables leaves them out.
+    """
+
+    def __init__(self, db_id: str, data: Dict[str, Any]):
+        self.db_id = db_id
+        self.all_tables: List[str] = data["tables"]
+        self.columns: Dict[str, List[list]] = data["columns"]
+        self.foreign_keys: Dict[str, List[list]] = data["foreign_keys"]
+        self.unique: Dict[str, List[str]] = data["unique"]
+        self.ddl: List[list] = data["ddl"]
+        self.descriptions: Optional[Dict[str, List[Dict[str, Any]]]] = data["descriptions"]
+        self.tables = [t for t in self.all_tables if not t.startswith("sqlite_")]
+        self.table_index = {t.lower(): t for t in self.tables}
+
+    @classmethod
+    def introspect(cls, db_id: str, db_path: Path, desc_path: Path) -> "SchemaCatalog":
+        data = {"tables": [], "columns": {}, "foreign_keys": {}, "unique": {}, "ddl": [], "descriptions": None}
+        with db_connection(db_path) as conn:
+            cur = conn.cursor()
+            data["tables"] = [r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name;")]
+            for table in data["tables"]:
+                data["columns"][table] = [[c[1], c[2], c[3], c[5]] for c in cur.execute(f"PRAGMA table_info('{table}');")]
+                data["foreign_keys"][table] = [[fk[3], fk[2], fk[4]] for fk in cur.execute(f"PRAGMA foreign_key_list('{table}');")]
+                unique = []
+                for index in cur.execute(f"PRAGMA index_list('{table}');").fetchall():
+                    if index[2]:
+                        info = cur.execute(f"PRAGMA index_info('{index[1]}');").fetchall()
+                        if len(info) == 1:
+                            unique.append(info[0][2])
+                data["unique"][table] = unique
+            data["ddl"] = [list(r) for r in cur.execute("SELECT type, name, sql FROM sqlite_master WHERE type IN ('table','view','index','trigger') AND name NOT LIKE 'sqlite_%' ORDER BY type, name;")]
+        if desc_path.exists():
+            with open(desc_path, "r", encoding="utf-8") as f:
+                data["descriptions"] = json.load(f)
+        return cls(db_id, data)
+
+    def referenced_tables(self, sql: str | List[str]) -> List[str]:
+        """Tables sql reads from, in catalog order.
+
+        Only identifiers in table positions count: right after FROM or JOIN, after a comma in a FROM list,
+        or a qualifier right before "." (x in x.col). Names are matched whole and case-insensitively, so
+        columns, aliases, literals, comments and keywords such as ORDER in ORDER BY are never picked up.
+        """
+        found = set()
+        for single_sql in [sql] if isinstance(sql, str) else sql:
+            tokens = [(t.value.lower(), t.kind == "quoted") for t in tokenize(single_sql)
+                      if t.kind in ("name", "quoted", "punct")]
+            # in_from: inside a FROM list at this paren depth; expect: the next identifier names a table.
+            in_from, expect, outer = False, False, []
+            for i, (token, quoted) in enumerate(tokens):
+                following = tokens[i + 1][0] if i + 1 < len(tokens) else None
+                if not quoted:
+                    if token == "(":
+                        outer.append(in_from)
+                        in_from = expect = False
+                        continue
+                    if token == ")":
+                        in_from, expect = (outer.pop() if outer else False), False
+                        continue
+                    if token in ("from", "join"):
+                        in_from = expect = True
+                        continue
+                    if token == ",":
+                        expect = in_from
+                        continue
+                    if token in _CLAUSE_KEYWORDS and (token not in ("order", "group") or following == "by"):
+                        in_from = expect = False
+                        continue
+                    if token == ".":
+                        continue
+                if following == ".":
+                    # main.t / temp.t: the table name comes after the schema.
+                    if expect and token in ("main", "temp") and not quoted:
+                        continue
+                    if token in self.table_index:
+                        found.add(self.table_index[token])
+                    expect = False
+                elif expect:
+                    if token in self.table_index:
+                        found.add(self.table_index[token])
+                    expect = False
+        return [t for t in self.tables if t in found]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"tables": self.all_tables, "columns": self.columns, "foreign_keys": self.foreign_keys,
+                "unique": self.unique, "ddl": self.ddl, "descriptions": self.descriptions}
+
+    def schema_lines(self, tables: List[str], kept_columns: Dict[str, set] = None) -> List[str]:
+        """'table (col TYPE PRIMARY KEY, col TYPE foreign key(t.c), ...)' per table; kept_columns holds lower-cased names"""
+        lines = []
+        for table in tables:
+            fk_dict = {fk[0]: f"{fk[1]}.{fk[2]}" for fk in self.foreign_keys.get(table, [])}
+            columns = self.columns.get(table, [])
+            col_definitions = []
+            for name, col_type, _, pk in columns:
+                if kept_columns is not None and name.lower() not in kept_columns[table]:
+                    continue
+                col_def = f"{name} {col_type}"
+                if pk: col_def += " PRIMARY KEY"
+                if name in fk_dict: col_def += f" foreign key({fk_dict[name]})"
+                col_definitions.append(col_def)
+            omitted = len(columns) - len(col_definitions)
+            if omitted:
+                col_definitions.append(f"... {omitted} more columns")
+            lines.append(f"{table} ({', '.join(col_definitions)})\n")
+        return lines
+
+    def description_blocks(self, tables: List[str], kept_columns: Dict[str, set] = None) -> List[str]:
+        """'-- Table: t' followed by column/value descriptions, for the tables that have any"""
+        blocks = []
+        if self.descriptions is None:
+            return blocks
+        for table in tables:
+            if table in self.descriptions:
+                table_desc = f"-- Table: {table}\n"
+                for col in self.descriptions[table]:
+                    if kept_columns is not None and (col.get("column_name") or "").strip().lower() not in kept_columns[table]:
+                        continue
+                    col_name, col_desc, val_desc = col.get("column_name"), col.get("column_description"), col.get("value_description")
+                    if col_desc and val_desc:
+                        table_desc += f"  {col_name}: {col_desc}; value_description: {val_desc}\n"
+                    elif col_desc:
+                        table_desc += f"  {col_name}: {col_desc}\n"
+                    elif val_desc:
+                        table_desc += f"  {col_name}: {val_desc}\n"
+                blocks.append(table_desc)
+        return blocks
+
+    def ddl_text(self) -> str:
+        """CREATE statements of every user table, view, index and trigger"""
+        ddls = [sql.strip().rstrip(";") + ";" for _, _, sql in self.ddl if sql]
+        return "\n\n".join(ddls) if self.ddl else "-- No user tables/views found"
+
+    def etm_schema(self) -> Dict[str, Dict[str, Any]]:
+        """The lower-cased {table: columns/primary_keys/foreign_keys/non_null/unique} dict ETM's get_schema builds"""
+        by_lower = {t.lower(): t for t in self.all_tables}
+        schema = {}
+        for table in self.all_tables:
+            columns = self.columns[table]
+            primary_keys = [c[0].lower() for c in columns if c[3] > 0]
+            foreign_keys = {}
+            for column, ref_table, ref_column in self.foreign_keys[table]:
+                if ref_column is None:
+                    # A foreign key without a column refers to the primary key of its table.
+                    ref_pks = [c[0] for c in self.columns.get(by_lower.get(ref_table.lower()), []) if c[3] == 1]
+                    assert len(ref_pks) == 1, "Foreign key referencing more than one primary key or no primary keys"
+                    ref_column = ref_pks[0]
+                foreign_keys[column.lower()] = f"{ref_table.lower()}.{ref_column.lower()}"
+            non_null = [c[0].lower() for c in columns if c[2] == 1]
+            unique = [u.lower() for u in self.unique[table]]
+            if len(primary_keys) == 1:
+                non_null += primary_keys
+                unique += primary_keys
+            schema[table.lower()] = {
+                "columns": [c[0].lower() for c in columns],
+                "primary_keys": primary_keys,
+                "foreign_keys": foreign_keys,
+                "non_null": list(set(non_null)),
+                "unique": list(set(unique)),
+            }
+        return deepcopy(schema)
+
+
+def configure_schema_catalog(cache_dir: str | Path):
+    """Directory for serialized catalogs (default cache/schema)"""
+    global _catalog_dir
+    _catalog_dir = Path(cache_dir)
+
+
+def _description_digest(desc_path: Path) -> str:
+    if not desc_path.exists():
+        return ""
+    with open(desc_path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _load_or_build(db_id: str, db_path: Path, desc_path: Path) -> SchemaCatalog:
+    key = f"{CATALOG_VERSION}:{file_digest(db_path)}:{_description_digest(desc_path)}"
+    cache_path = _catalog_dir / f"{db_id}.json"
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return SchemaCatalog(db_id, cached["catalog"])
+    except (OSError, ValueError, KeyError):
+        pass
+    catalog = SchemaCatalog.introspect(db_id, db_path, desc_path)
+    # utils imports this module, so its helpers are imported on first use.
+    from .utils import atomic_write
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        atomic_write(cache_path, lambda f: json.dump({"key": key, "catalog": catalog.to_dict()}, f, ensure_ascii=False))
+    except OSError:
+        pass
+    return catalog
+
+
+def get_catalog(db_id: str, root: str | Path = ".") -> SchemaCatalog:
+    """Process-wide SchemaCatalog of root/dev_databases/<db_id>, built on first use or read from the catalog cache"""
+    db_path = Path(root) / "dev_databases" / db_id / f"{db_id}.sqlite"
+    registry_key = os.path.abspath(db_path)
+    catalog = _catalogs.get(registry_key)
+    if catalog is not None:
+        return catalog
+    with _lock:
+        db_lock = _locks.setdefault(registry_key, threading.Lock())
+    with db_lock:
+        catalog = _catalogs.get(registry_key)
+        if catalog is None:
+            desc_path = Path(root) / "data" / "description" / f"{db_id}_schema.json"
+            catalog = _catalogs[registry_key] = _load_or_build(db_id, db_path, desc_path)
+    return catalog
@@ -0,0 +1,92 @@
+import json
+import time
+import threading
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+
+# USD per 1M (prompt, cached prompt, completion) tokens at list price; override with load_prices.
+PRICES: Dict[str, Tuple[float, float, float]] = {
+    "o3": (2.0, 0.5, 8.0),
+    "gpt-5": (1.25, 0.125, 10.0),
+    "deepseek-chat": (0.28, 0.028, 0.42),
+    "gemini-2.5-pro-thinking": (1.25, 0.31, 10.0),
+}
+STAGE_ORDER = ("prover", "refuter", "decomposer", "translator", "grader")
+
+
+def load_prices(path: str) -> Dict[str, Tuple[float, float, float]]:
+    """{model: [prompt, cached prompt, completion]} USD per 1M tokens from a JSON file"""
+    with open(path, "r", encoding="utf-8") as f:
+        return {model: tuple(float(p) for p in price) for model, price in json.load(f).items()}
+
+
+class LLMTelemetry:
+    """One JSONL record per LLM call (tokens, latency, attempts, stage, model) plus a per-stage summary"""
+
+    def __init__(self, path: str, prices: Dict[str, Tuple[float, float, float]] = None):
+        self.path = path
+        self.prices = {**PRICES, **(prices or {})}
+        self.records: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+        self.file = open(path, "a", encoding="utf-8")
+
+    def record(self, stage: str, model: str, source: str, latency: float, usage=None, attempts: int = 1, error: Exception = None):
+        """source is "api", "stream" (usage unavailable once closed early) or "cache" (no request sent)"""
+        prompt_details = getattr(usage, "prompt_tokens_details", None)
+        completion_details = getattr(usage, "completion_tokens_details", None)
+        record = {
+            "time": time.time(),
+            "stage": stage or "other",
+            "model": model,
+            "source": source,
+            "latency": round(latency, 4),
+            "attempts": attempts,
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "completion_tokens": getattr(usage, "completion_tokens", None),
+            "reasoning_tokens": getattr(completion_details, "reasoning_tokens", None),
+            "cached_tokens": getattr(prompt_details, "cached_tokens", None),
+            "error": f"{type(error).__name__}: {error}" if error is not None else None,
+        }
+        record["cost"] = self.cost(record)
+        with self.lock:
+            self.records.append(record)
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def cost(self, record: Dict[str, Any]) -> Optional[float]:
+        price = self.prices.get(record["model"])
+        if price is None or record["prompt_tokens"] is None:
+            return None
+        cached = record["cached_tokens"] or 0
+        return ((record["prompt_tokens"] - cached) * price[0] + cached * price[1] + (record["completion_tokens"] or 0) * price[2]) / 1e6
+
+    def summary(self) -> str:
+        """Table of calls, p50/p95 latency of sent requests, tokens and estimated cost per stage and model"""
+        with self.lock:
+            records = list(self.records)
+        groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for r in records:
+            groups.setdefault((r["stage"], r["model"]), []).append(r)
+        order = {stage: i for i, stage in enumerate(STAGE_ORDER)}
+        header = ("stage", "model", "calls", "cache hits", "errors", "p50 s", "p95 s", "prompt", "cached tok", "completion", "reasoning", "cost $")
+        rows = [self._row(stage, model, rs) for (stage, model), rs in sorted(groups.items(), key=lambda kv: (order.get(kv[0][0], len(order)), kv[0]))]
+        if len(rows) > 1:
+            rows.append(self._row("total", "", records))
+        widths = [max(len(str(row[i])) for row in [header] + rows) for i in range(len(header))]
+        lines = ["  ".join(str(cell).ljust(w) for cell, w in zip(row, widths)) for row in [header] + rows]
+        return "LLM calls:\n" + "\n".join(lines)
+
+    @staticmethod
+    def _row(stage: str, model: str, records: List[Dict[str, Any]]) -> tuple:
+        sent = [r["latency"] for r in records if r["source"] != "cache" and r["error"] is None]
+        p50, p95 = (f"{np.percentile(sent, q):.2f}" for q in (50, 95)) if sent else ("-", "-")
+        total = lambda key: sum(r[key] or 0 for r in records)
+        costs = [r["cost"] for r in records if r["source"] != "cache" and r["error"] is None]
+        # Streamed calls closed early report no usage, so their cost is unknown.
+        cost = f"{sum(costs):.4f}" if costs and None not in costs else (f">={sum(c for c in costs if c):.4f}" if any(costs) else "-")
+        return (stage, model, len(records), sum(r["source"] == "cache" for r in records), sum(r["error"] is not None for r in records),
+                p50, p95, total("prompt_tokens"), total("cached_tokens"), total("completion_tokens"), total("reasoning_tokens"), cost)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
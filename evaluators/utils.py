@@ -1,26 +1,25 @@
 import json
 import os
-import sqlite3
 import re
+import time
 import pandas as pd
-import numpy as np
 from pathlib import Path
 import threading
-from pandas.util import hash_pandas_object
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Callable, Any
-import multiprocessing as mp
+from .connections import db_connection
+from .schema import get_catalog
+from .lexer import tokenize, strip_trailing
+from .executor import run_on_backend
+from .results import ResultSummary, ResultAccumulator, PREVIEW_ROWS, FETCH_SIZE, fingerprint_of
 
 def _get_db_path(db_id: str) -> Path:
     return Path("dev_databases") / db_id / f"{db_id}.sqlite"
 
-def _execute_db_query(db_id: str, query: str, params: tuple = None):
-    db_path = _get_db_path(db_id)
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.cursor()
-        if params:
-            return cur.execute(query, params).fetchall()
-        else:
-            return cur.execute(query).fetchall()
+def _resolve_db_path(db: str | Path) -> Path:
+    """db itself when it is already a Path, otherwise the database file of db_id db"""
+    return db if isinstance(db, Path) else _get_db_path(db)
 
 def extract_json_from_response(response: str) -> str:
     response = response.strip()
@@ -35,49 +34,197 @@ def extract_json_from_response(response: str) -> str:
                 return extracted
     return response
 
-def execute_sql(db: str | Path, sql: str) -> pd.DataFrame | bool:
-    db_path = Path(db) if isinstance(db, Path) else _get_db_path(db)
+def has_verdict(content: str) -> bool:
+    """Whether the JSON answer in content is an object with a non-null verdict"""
+    try:
+        result = json.loads(extract_json_from_response(content))
+    except (ValueError, TypeError, AttributeError):
+        return False
+    return isinstance(result, dict) and result.get("verdict") is not None
+
+def is_json_array(content: str) -> bool:
+    """Whether the JSON answer in content is an array, the shape Decomposer, Translator and Grader parse"""
     try:
-        with sqlite3.connect(db_path) as conn:
+        result = json.loads(extract_json_from_response(content))
+    except (ValueError, TypeError, AttributeError):
+        return False
+    return isinstance(result, list)
+
+class JSONObjectScanner:
+    """Incremental scan of streamed text for the first complete top-level JSON object holding required_key"""
+
+    def __init__(self, required_key: str = None):
+        self.required_key = required_key
+        self.text = ""
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> str | None:
+        """Append chunk; returns the object's text once its closing brace arrives"""
+        self.text += chunk
+        while self._pos < len(self.text):
+            c = self.text[self._pos]
+            self._pos += 1
+            if self._start is None:
+                if c == "{":
+                    self._start, self._depth = self._pos - 1, 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+            elif c == '"':
+                self._in_string = True
+            elif c == "{":
+                self._depth += 1
+            elif c == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        obj = json.loads(self.text[self._start:self._pos])
+                    except ValueError:
+                        # A brace in prose before the answer: rescan from just after it.
+                        self._pos, self._start = self._start + 1, None
+                        continue
+                    if self.required_key is not None and not (isinstance(obj, dict) and self.required_key in obj):
+                        # An example or intermediate object: keep reading for the answer.
+                        self._start = None
+                        continue
+                    return self.text[self._start:self._pos]
+        return None
+
+def _read_sql(db_path: Path, sql: str) -> pd.DataFrame | bool:
+    try:
+        with db_connection(db_path) as conn:
             return pd.read_sql_query(sql, conn)
     except Exception as e:
-        print(f"SQL execution failed for db={db}, sql={sql[:100]}..., error: {e}")
+        print(f"SQL execution failed for db={db_path}, sql={sql[:100]}..., error: {e}")
         return False
 
-def compare_result(df1: pd.DataFrame, df2: pd.DataFrame) -> bool:
-    if df1.shape != df2.shape:
+_result_cache = None
+
+def set_result_cache(cache):
+    """Install a result cache (e.g. cache.SQLResultCache) that execute_sql consults before executing"""
+    global _result_cache
+    _result_cache = cache
+
+def get_result_cache():
+    return _result_cache
+
+def execute_sql(db: str | Path, sql: str) -> pd.DataFrame | bool:
+    db_path = _resolve_db_path(db)
+    if _result_cache is not None:
+        return _result_cache.fetch(db_path, sql, lambda: _read_sql(db_path, sql))
+    return _read_sql(db_path, sql)
+
+def summarize_sql(db: str | Path, sql: str, semantics: str = "bag", preview_rows: int = PREVIEW_ROWS) -> ResultSummary | bool:
+    """Execute sql streaming rows with fetchmany, keeping only the semantics fingerprint, counts and a bounded preview"""
+    db_path = _resolve_db_path(db)
+    try:
+        with db_connection(db_path) as conn:
+            cur = conn.execute(sql)
+            if cur.description is None:
+                raise ValueError("statement returned no result set")
+            acc = ResultAccumulator([d[0] for d in cur.description], preview_rows, semantics)
+            while True:
+                rows = cur.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                acc.add(rows)
+    except Exception as e:
+        print(f"SQL execution failed for db={db}, sql={sql[:100]}..., error: {e}")
         return False
-    return hash_dataframe(df1) == hash_dataframe(df2)
+    return acc.summary()
 
-def hash_dataframe(df: pd.DataFrame) -> int:
-    df_str = df.map(str)
-    row_hash = None
-    for col in df_str.columns:
-        h_col = hash_pandas_object(df_str[col], index=False).to_numpy()
-        row_hash = h_col if row_hash is None else np.bitwise_xor(row_hash, h_col)
-    return int(np.bitwise_xor.reduce(row_hash))
+def _as_subquery(sql: str) -> str:
+    # A trailing ";" or comment inside "(...)" would be a syntax error or swallow the closing parenthesis.
+    return strip_trailing(sql).strip()
 
-def _worker(q: mp.Queue, func: Callable[..., Any], args: tuple, kwargs: dict):
+def probe_sql(db: str | Path, sql: str) -> tuple | bool:
+    """(row_count, column_count) of sql via COUNT(*), without fetching any of its rows"""
+    db_path = _resolve_db_path(db)
     try:
-        res = func(*args, **kwargs)
-        q.put(res)
-    except Exception:
-        q.put(False)
-
-def run_with_timeout(func: Callable[..., Any], *args, timeout: float = 2.0, **kwargs) -> Any:
-    ctx = mp.get_context("spawn")
-    q: mp.Queue = ctx.Queue(maxsize=1)
-    p = ctx.Process(target=_worker, args=(q, func, args, kwargs), daemon=True)
-    p.start()
-    p.join(timeout)
-    if p.is_alive():
-        p.terminate()
-        p.join()
-        return None
+        with db_connection(db_path) as conn:
+            num_columns = len(conn.execute(f"SELECT * FROM ({_as_subquery(sql)}) LIMIT 0").description)
+            num_rows = conn.execute(f"SELECT COUNT(*) FROM ({_as_subquery(sql)})").fetchone()[0]
+    except Exception as e:
+        print(f"SQL probe failed for db={db}, sql={sql[:100]}..., error: {e}")
+        return False
+    return (num_rows, num_columns)
+
+def preview_sql(db: str | Path, sql: str, row_count: int, preview_rows: int = PREVIEW_ROWS) -> ResultSummary | bool:
+    """Summary holding only the first preview_rows rows and a probed row_count; it carries no fingerprints"""
+    db_path = _resolve_db_path(db)
     try:
-        return q.get_nowait()
-    except Exception:
+        with db_connection(db_path) as conn:
+            cur = conn.execute(sql)
+            columns = [d[0] for d in cur.description]
+            rows = cur.fetchmany(preview_rows)
+    except Exception as e:
+        print(f"SQL execution failed for db={db}, sql={sql[:100]}..., error: {e}")
         return False
+    preview = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+    return ResultSummary({}, row_count, columns, [str(t) for t in preview.dtypes], preview)
+
+def compare_result(df1: pd.DataFrame | ResultSummary, df2: pd.DataFrame | ResultSummary, semantics: str = "bag") -> bool:
+    """Compare two results by fingerprint under "bag", "set" (BIRD EX) or "list" row semantics"""
+    # Under set semantics duplicate rows collapse, so differing row counts may still compare equal.
+    if semantics != "set" and df1.shape != df2.shape:
+        return False
+    return fingerprint_of(df1, semantics) == fingerprint_of(df2, semantics)
+
+def run_with_timeout(func: Callable[..., Any], *args, timeout: float = 2.0, cancel: threading.Event = None, cached: bool = True, **kwargs) -> Any:
+    """func(*args) under timeout on the configured backend; cached=False skips the SQL result cache, e.g. for
+    gold SQL that GoldResultCache already stores"""
+    if cached and func in (execute_sql, summarize_sql, probe_sql) and _result_cache is not None and 2 <= len(args) <= 3 and not kwargs:
+        # Look up in this process so cache hits never reach a worker; only successful runs are cached.
+        db, sql, *rest = args
+        db_path = _resolve_db_path(db)
+        target = _read_sql if func is execute_sql else func
+        kind = ":".join([func.__name__, *map(str, rest)])
+        return _result_cache.fetch(db_path, sql, lambda: run_on_backend(target, db_path, sql, *rest, timeout=timeout, cancel=cancel), kind=kind)
+    return run_on_backend(func, *args, timeout=timeout, cancel=cancel, **kwargs)
+
+_concurrent = ThreadPoolExecutor(max_workers=32, thread_name_prefix="sql-concurrent")
+
+def configure_concurrency(callers: int):
+    """Size run_together's pool for callers threads running two-call pairs at once.
+
+    A job waiting in the pool's queue would already be spending the shared deadline, so the pool
+    must never be smaller than the number of concurrent callers.
+    """
+    global _concurrent
+    old, _concurrent = _concurrent, ThreadPoolExecutor(max_workers=max(1, callers), thread_name_prefix="sql-concurrent")
+    old.shutdown(wait=False)
+
+def run_together(calls: List[tuple], timeout: float = 120, decisive: tuple = (0,), uncached: tuple = ()) -> List[Any]:
+    """Run (func, *args) calls concurrently through run_with_timeout under one shared deadline.
+
+    Once a call listed in decisive fails (returns False), calls still running are cancelled and return None.
+    Calls listed in uncached skip the SQL result cache.
+    """
+    expires_at = time.monotonic() + timeout
+    cancels = [threading.Event() for _ in calls]
+
+    def run(i):
+        func, *args = calls[i]
+        remaining = expires_at - time.monotonic()
+        if remaining <= 0 or cancels[i].is_set():
+            return None
+        res = run_with_timeout(func, *args, timeout=remaining, cancel=cancels[i], cached=i not in uncached)
+        if res is False and i in decisive:
+            for j, cancel in enumerate(cancels):
+                if j != i:
+                    cancel.set()
+        return res
+
+    futures = [_concurrent.submit(run, i) for i in range(1, len(calls))]
+    return [run(0)] + [f.result() for f in futures]
 
 def save_json(data, output_file, append=False):
     if not hasattr(save_json, "_lock"):
@@ -91,6 +238,26 @@ def save_json(data, output_file, append=False):
         else:
             with open(output_file, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+def atomic_write(path: str | Path, write: Callable[[Any], None], binary: bool = False, max_bytes: int = None) -> int | None:
+    """Call write(f) on a temporary file next to path, then rename it over path so readers never see a partial file.
+
+    Returns the size written, or None with nothing written when it exceeds max_bytes.
+    """
+    path = Path(path)
+    tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") if binary else open(tmp, "w", encoding="utf-8") as f:
+            write(f)
+        size = tmp.stat().st_size
+        if max_bytes is not None and size > max_bytes:
+            tmp.unlink()
+            return None
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return size
+
 
 def write_result_to_file(question, pred_sql, score, prover_result, refuter_result, output_dir="output"):
     output_file = os.path.join(output_dir, "eval_results.json")
@@ -107,44 +274,137 @@ def write_result_to_file(question, pred_sql, score, prover_result, refuter_resul
     result.update({k: question[k] for k in ("label", "difficulty") if k in question})
     save_json(result, output_file, append=True)
 
-def get_db_info(db_id: str, sql: str | list[str]) -> str:
-    all_tables = [row[0] for row in _execute_db_query(db_id, "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name;")]
+def _all_tables(db_id: str) -> List[str]:
+    return get_catalog(db_id).tables
+
+def _involved_tables(db_id: str, sql_list: List[str]) -> List[str]:
+    return get_catalog(db_id).referenced_tables(sql_list)
+
+def get_db_info(db_id: str, sql: str | list[str], neighbors: int = None) -> str:
+    """Schema and descriptions of the tables sql mentions; with neighbors, pruned as in prune_db_info"""
+    if neighbors is not None:
+        return prune_db_info(db_id, sql, neighbors)[0]
     sql_list = [sql] if isinstance(sql, str) else sql
-    involved_tables = list(set(t for single_sql in sql_list for t in all_tables if t.upper() in single_sql.upper()))
-    
-    schema_lines = []
-    for table in involved_tables:
-        table_info = _execute_db_query(db_id, f"PRAGMA table_info('{table}');")
-        fk_info = _execute_db_query(db_id, f"PRAGMA foreign_key_list('{table}');")
-        fk_dict = {fk[3]: f"{fk[2]}.{fk[4]}" for fk in fk_info}
-        
-        col_definitions = []
-        for col in table_info:
-            col_def = f"{col[1]} {col[2]}"
-            if col[5]: col_def += " PRIMARY KEY"
-            if col[1] in fk_dict: col_def += f" foreign key({fk_dict[col[1]]})"
-            col_definitions.append(col_def)
-        schema_lines.append(f"{table} ({', '.join(col_definitions)})\n")
-    
-    descriptions = []
-    desc_file = Path("data/description") / f"{db_id}_schema.json"
-    if desc_file.exists():
-        with open(desc_file, 'r', encoding='utf-8') as f:
-            schema_data = json.load(f)
-        for table in involved_tables:
-            if table in schema_data:
-                table_desc = f"-- Table: {table}\n"
-                for col in schema_data[table]:
-                    col_name, col_desc, val_desc = col.get("column_name"), col.get("column_description"), col.get("value_description")
-                    if col_desc and val_desc:
-                        table_desc += f"  {col_name}: {col_desc}; value_description: {val_desc}\n"
-                    elif col_desc:
-                        table_desc += f"  {col_name}: {col_desc}\n"
-                    elif val_desc:
-                        table_desc += f"  {col_name}: {val_desc}\n"
-                descriptions.append(table_desc)
+    return _render_db_info(db_id, _involved_tables(db_id, sql_list))
+
+# A "*" after one of these selects every column (SELECT *, t.*); elsewhere it is count(*) or a product.
+_STAR_AFTER = {"select", "distinct", "all", ",", "."}
+
+def sql_identifiers(sql: str) -> tuple[set, bool]:
+    """Lower-cased, unquoted identifiers in sql and whether it selects * (bare or table.*)"""
+    names, star = set(), False
+    previous = None
+    for token in tokenize(sql):
+        if token.kind in ("space", "comment"):
+            continue
+        if token.kind in ("name", "quoted"):
+            names.add(token.value)
+        elif token.text == "*":
+            star = star or previous in _STAR_AFTER
+        previous = token.value if token.kind != "quoted" else None
+    return names, star
+
+def _kept_columns(db_id: str, table: str, names: set, neighbors: int) -> set:
+    """Lower-cased names of the columns of table that prune_db_info keeps"""
+    catalog = get_catalog(db_id)
+    fk_columns = {fk[0] for fk in catalog.foreign_keys[table]}
+    columns = [col[0] for col in catalog.columns[table]]
+    referenced = [i for i, name in enumerate(columns) if name.lower() in names]
+    kept = {columns[j].lower() for i in referenced for j in range(max(0, i - neighbors), min(len(columns), i + neighbors + 1))}
+    kept.update(col[0].lower() for col in catalog.columns[table] if col[3] or col[0] in fk_columns)
+    return kept
+
+_pruning_stats = {"prompts": 0, "full_tokens": 0, "pruned_tokens": 0}
+_pruning_lock = threading.Lock()
+
+def prune_db_info(db_id: str, sql: str | list[str], neighbors: int = 2) -> tuple[str, int, int]:
+    """db_info limited to the columns the SQL references, primary/foreign keys and up to neighbors
+    columns on either side of each referenced one (declaration order); every column of a table is
+    kept when the SQL selects *. Returns (db_info, full tokens, pruned tokens) with ~4 chars per token."""
+    sql_list = [sql] if isinstance(sql, str) else sql
+    tables = _involved_tables(db_id, sql_list)
+    names, star = set(), False
+    for single_sql in sql_list:
+        single_names, single_star = sql_identifiers(single_sql)
+        names |= single_names
+        star = star or single_star
+    full = pruned = _render_db_info(db_id, tables)
+    if not star:
+        candidate = _render_db_info(db_id, tables, {t: _kept_columns(db_id, t, names, neighbors) for t in tables})
+        # The omission marker can outweigh what narrow tables drop.
+        if len(candidate) < len(full):
+            pruned = candidate
+    full_tokens, pruned_tokens = len(full) // 4, len(pruned) // 4
+    with _pruning_lock:
+        _pruning_stats["prompts"] += 1
+        _pruning_stats["full_tokens"] += full_tokens
+        _pruning_stats["pruned_tokens"] += pruned_tokens
+    return pruned, full_tokens, pruned_tokens
+
+def schema_pruning_report() -> str:
+    with _pruning_lock:
+        s = dict(_pruning_stats)
+    saved = s["full_tokens"] - s["pruned_tokens"]
+    return (f"Schema pruning: {s['prompts']} prompts, ~{s['full_tokens']} -> ~{s['pruned_tokens']} schema tokens "
+            f"({saved / max(1, s['full_tokens']):.1%} saved, ~{saved // max(1, s['prompts'])} per prompt)")
+
+def get_full_db_info(db_id: str) -> str:
+    """Schema and descriptions of every table in name order; identical for all questions on db_id"""
+    return _render_db_info(db_id, _all_tables(db_id))
+
+class RenderedSchemaCache:
+    """Bounded LRU of rendered db_info text keyed by (db_id, frozenset(tables), rendering options)"""
+
+    def __init__(self, max_entries: int = 4096):
+        self.max_entries = max_entries
+        self.memory: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    def get_or_render(self, key: tuple, render: Callable[[], str]) -> str:
+        with self.lock:
+            text = self.memory.get(key)
+            if text is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return text
+            self.misses += 1
+        # Rendered outside the lock; two threads missing the same key both render identical text.
+        text = render()
+        with self.lock:
+            self.memory[key] = text
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+                self.evicted += 1
+        return text
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def report(self) -> str:
+        return (f"Rendered schema cache: {self.hits} hits, {self.misses} misses (hit ratio {self.hit_ratio:.1%}), "
+                f"{len(self.memory)} entries, {self.evicted} evicted")
+
+rendered_schema_cache = RenderedSchemaCache()
+
+def _render_db_info(db_id: str, involved_tables: List[str], kept_columns: Dict[str, set] = None) -> str:
+    options = None if kept_columns is None else frozenset((t, frozenset(cols)) for t, cols in kept_columns.items())
+    key = (db_id, frozenset(involved_tables), options)
+    return rendered_schema_cache.get_or_render(key, lambda: _build_db_info(db_id, involved_tables, kept_columns))
+
+def _build_db_info(db_id: str, involved_tables: List[str], kept_columns: Dict[str, set] = None) -> str:
+    catalog = get_catalog(db_id)
+    # Catalog order, so the text does not depend on the order the tables were passed in.
+    involved_tables = [t for t in catalog.tables if t in set(involved_tables)]
+    schema_lines = catalog.schema_lines(involved_tables, kept_columns)
+    descriptions = catalog.description_blocks(involved_tables, kept_columns)
     
     result = f"Database: {db_id}\n"
     if schema_lines: result += "Schema:\n" + "\n".join(schema_lines) + "\n\n"
     if descriptions: result += "Descriptions:\n" + "\n".join(descriptions)
-    return result
\ No newline at end of file
+    return result
@@ -0,0 +1,39 @@
+import os
+import openai
+from typing import Dict, Any, List
+from .llm import get_client
+from .utils import get_db_info, prune_db_info, save_json
+
+
+class Verifier:
+    """Clients, prompt options and output file shared by the Prover and the Refuter"""
+
+    def __init__(self, model: str = None, output_dir: str = "output", client: openai.OpenAI = None, async_client: openai.AsyncOpenAI = None, prefix_cache: bool = False, schema_neighbors: int = None, stream: bool = False):
+        self.model = model
+        self.prefix_cache = prefix_cache
+        # None sends whole tables; a number prunes them to referenced columns, keys and that many neighbors.
+        self.schema_neighbors = schema_neighbors
+        self.schema_tokens: Dict[str, Dict[str, int]] = {}
+        # Stream answers and stop reading once the verdict object is complete.
+        self.stream = stream
+        self.output_dir = output_dir
+        self.client = client or get_client(model)
+        self.async_client = async_client
+
+    def _db_info(self, question: Dict[str, Any], sql: str | List[str]) -> str:
+        if self.schema_neighbors is None:
+            return get_db_info(question["db_id"], sql)
+        db_info, full, pruned = prune_db_info(question["db_id"], sql, self.schema_neighbors)
+        self.schema_tokens[str(question["question_id"])] = {"full": full, "pruned": pruned}
+        return db_info
+
+    def _save(self, question: Dict[str, Any], result: Dict[str, Any], output_name: str):
+        """Append the parsed answer (and schema token counts when pruned) to output_dir/output_name"""
+        output_data = {
+            "question_id": question["question_id"],
+            "result": result
+        }
+        schema_tokens = self.schema_tokens.pop(str(question["question_id"]), None)
+        if schema_tokens is not None:
+            output_data["schema_tokens"] = schema_tokens
+        save_json(output_data, os.path.join(self.output_dir, output_name), append=True)
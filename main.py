@@ -1,75 +1,430 @@
 import json
 import os
 import argparse
+import asyncio
 import re
+import time
+import pickle
 from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from evaluators.PartialGrader import PartialScoringPipeline
-from evaluators.utils import execute_sql, write_result_to_file, run_with_timeout, compare_result
+from evaluators.utils import _get_db_path, execute_sql, summarize_sql, probe_sql, preview_sql, write_result_to_file, run_with_timeout, run_together, configure_concurrency, compare_result
+from evaluators.executor import configure_sql_backend, run_everywhere
+from evaluators.connections import select_replicas, load_replicas, replica_stats
+from collections import Counter
+from evaluators.cache import GoldResultCache
+from evaluators.cli import add_run_arguments, RunSetup, run_bounded, run_steps, arun_steps, run_sql
+from evaluators.batch import write_batch_requests, read_batch_responses
+from evaluators.partial_scoring import Decomposer, Translator, Grader
+from evaluators.failures import Failure, take_failure, retry_delay, SQL_TIMEOUT, SQL_ERROR
 from tqdm import tqdm
 from evaluators.Prover import Prover
 from evaluators.Refuter import Refuter
 
  
 
-def _process_question(question):
+def _execute_pair(db_id, pred_sql, gold_sql, pred_res=None, gold_res=None, timeout=120):
+    """Results of pred and gold SQL, executing only the sides not already known"""
+    # Cached gold results are summaries, so pred is summarized too: a DataFrame and a chunked summary of the
+    # same rows can type a column differently (int64 vs float64 around NULLs) and fingerprint differently.
+    execute = summarize_sql if stream_results or gold_cache is not None else execute_sql
+    if gold_res is None and gold_cache is not None:
+        gold_res = gold_cache.get(db_id, gold_sql)
+    if pred_res is not None:
+        if gold_res is None:
+            gold_res = run_with_timeout(execute, db_id, gold_sql, timeout=timeout, cached=gold_cache is None)
+            if gold_cache is not None and gold_res is not None:
+                gold_cache.put(db_id, gold_sql, gold_res)
+        return pred_res, gold_res
+    if probe_timeout and gold_res is not False:
+        if gold_res is None:
+            pred_shape, gold_shape = run_together([(probe_sql, db_id, pred_sql), (probe_sql, db_id, gold_sql)], timeout=probe_timeout)
+        else:
+            pred_shape, gold_shape = run_with_timeout(probe_sql, db_id, pred_sql, timeout=probe_timeout), gold_res.shape
+        if pred_shape and gold_shape and tuple(pred_shape) != tuple(gold_shape):
+            # Shapes already differ, so only the previews the Prover and Refuter read are fetched.
+            if gold_res is not None:
+                return run_with_timeout(preview_sql, db_id, pred_sql, pred_shape[0], timeout=timeout), gold_res
+            return tuple(run_together([(preview_sql, db_id, pred_sql, pred_shape[0]), (preview_sql, db_id, gold_sql, gold_shape[0])], timeout=timeout))
+    if gold_res is not None:
+        return run_with_timeout(execute, db_id, pred_sql, timeout=timeout), gold_res
+    # A failing predicted SQL scores 0 whatever gold returns, so it cancels the gold run.
+    # The gold cache owns gold results, so they are not stored a second time in the SQL result cache.
+    pred_res, gold_res = run_together([(execute, db_id, pred_sql), (execute, db_id, gold_sql)], timeout=timeout,
+                                      uncached=(1,) if gold_cache is not None else ())
+    if gold_cache is not None and gold_res is not None:
+        gold_cache.put(db_id, gold_sql, gold_res)
+    return pred_res, gold_res
+
+
+class QuestionState:
+    """Intermediate results of one question, kept so an in-run retry only redoes the stage that failed"""
+
+    def __init__(self):
+        self.pred_res = None
+        self.gold_res = None
+        self.prover = None
+        self.refuter = None
+        self.sql_timeout = 120
+        self.failure = None
+        self.retries = Counter()
+
+    def fail(self, failure):
+        self.failure = failure
+        if failure.kind == SQL_TIMEOUT:
+            self.sql_timeout *= 2
+        return failure
+
+    def release(self):
+        """Drop the kept results once the question leaves the queue; the failure stays for the report"""
+        self.pred_res = self.gold_res = None
+
+    def next_retry_delay(self):
+        """Seconds before this question may be retried, or None when its failure is not retried again"""
+        delay = retry_delay(self.failure.kind, self.retries[self.failure.kind])
+        if delay is not None:
+            self.retries[self.failure.kind] += 1
+        return delay
+
+
+def _sql_failure(state):
+    """Failure of the SQL stage, or None when both results are usable"""
+    if state.pred_res is None or state.gold_res is None:
+        return state.fail(Failure(SQL_TIMEOUT, "sql"))
+    if state.gold_res is False:
+        return state.fail(Failure(SQL_ERROR, "sql", "gold SQL failed to execute"))
+    return None
+
+
+def _question_steps(question, state):
+    """Score one question, yielding each blocking step as (stage, args); returns None when done, otherwise the Failure left in state"""
     pred_sql = question["predicted_sql"]
     db_id = question["db_id"]
     gold_sql = question["gold_sql"]
 
-    pred_res = run_with_timeout(execute_sql, db_id, pred_sql, timeout=120)
-    gold_res = run_with_timeout(execute_sql, db_id, gold_sql, timeout=120)
+    if state.pred_res is None or state.gold_res is None:
+        state.pred_res, state.gold_res = yield "sql", (db_id, pred_sql, gold_sql, state.pred_res, state.gold_res, state.sql_timeout)
+    pred_res, gold_res = state.pred_res, state.gold_res
 
     score = 0.0
     refuter_verdict = None
     prover_verdict = None
-    qid = str(question.get("question_id"))
 
-    if pred_res is None or gold_res is None:
-        return qid
     if pred_res is False:
         score = 0.0
-        write_result_to_file(question, pred_sql, score, prover_verdict, refuter_verdict, output_dir)
+        yield "write", (question, pred_sql, score, prover_verdict, refuter_verdict, output_dir)
         return None
+    failure = _sql_failure(state)
+    if failure:
+        return failure
 
-    if compare_result(pred_res, gold_res):
-        refuter_verdict = Refuter.call(question, pred_sql)
-        if refuter_verdict is None:
-            return qid
+    if (yield "compare", (pred_res, gold_res)):
+        if state.refuter is None:
+            state.refuter = yield "refuter", (question, pred_sql)
+            if state.refuter is None:
+                return state.fail(take_failure("refuter"))
+        refuter_verdict = state.refuter
         score = 1.0 if not refuter_verdict else 0.0
-    elif pred_res is not None:
-        prover_verdict, prover_reason = Prover.call(question, pred_sql, pred_res)
-        if prover_verdict is None:
-            return qid
+    else:
+        if state.prover is None:
+            verdict, reason = yield "prover", (question, pred_sql, pred_res)
+            if verdict is None:
+                return state.fail(take_failure("prover"))
+            state.prover = (verdict, reason)
+        prover_verdict, prover_reason = state.prover
         if prover_verdict:
-            refuter_verdict = Refuter.call(question, pred_sql, pred_res, gold_res, prover_reason)
-            if refuter_verdict is None:
-                return qid
+            if state.refuter is None:
+                state.refuter = yield "refuter", (question, pred_sql, pred_res, gold_res, prover_reason)
+                if state.refuter is None:
+                    return state.fail(take_failure("refuter"))
+            refuter_verdict = state.refuter
             score = 1.0 if not refuter_verdict else 0.0
 
         if score != 1.0 and partial:
-            score = PartialEval.eval(question, pred_sql)
+            score = yield "partial", (question, pred_sql)
+
+    yield "write", (question, pred_sql, score, prover_verdict, refuter_verdict, output_dir)
+    return None
+
+
+def _run_step(stage, *args):
+    if stage == "sql":
+        return _execute_pair(*args)
+    if stage == "compare":
+        return compare_result(*args)
+    if stage == "prover":
+        return Prover.call(*args)
+    if stage == "refuter":
+        return Refuter.call(*args)
+    if stage == "partial":
+        return PartialEval.eval(*args)
+    return write_result_to_file(*args)
+
+
+async def _arun_step(stage, *args):
+    """SQL on the SQL executor, LLM calls awaited on the event loop, the rest on the default executor"""
+    if stage == "sql":
+        return await run_sql(_execute_pair, *args)
+    if stage == "prover":
+        return await Prover.acall(*args)
+    if stage == "refuter":
+        return await Refuter.acall(*args)
+    if stage == "partial":
+        return await PartialEval.aeval(*args)
+    return await asyncio.to_thread(_run_step, stage, *args)
+
+
+def _process_question(question, state):
+    """Score one question; returns None when done, otherwise the Failure left in state"""
+    return run_steps(_question_steps(question, state), _run_step)
+
+
+async def _aprocess_question(question, state):
+    """_process_question awaited on the event loop"""
+    return await arun_steps(_question_steps(question, state), _arun_step)
+
+
+def _run_threads(questions, states, num_threads, progress):
+    """Process questions on worker threads; failed ones are requeued in rounds while their retry policy allows"""
+    pending = list(questions)
+    problems = []
+    while pending:
+        def worker(idx):
+            failed = []
+            for q in pending[idx::num_threads]:
+                state = states[str(q.get("question_id"))]
+                if _process_question(q, state):
+                    failed.append(q)
+                else:
+                    state.release()
+                progress.update(1)
+            return failed
+
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            failed = [q for f in [executor.submit(worker, i) for i in range(num_threads)] for q in f.result()]
+        pending, wait = [], 0.0
+        for q in failed:
+            state = states[str(q.get("question_id"))]
+            delay = state.next_retry_delay()
+            if delay is None:
+                state.release()
+                problems.append(q)
+            else:
+                pending.append(q)
+                wait = max(wait, delay)
+        if pending:
+            print(f"Requeueing {len(pending)} failed questions: {dict(Counter(states[str(q.get('question_id'))].failure.kind for q in pending))}")
+            progress.total += len(pending)
+            progress.refresh()
+            time.sleep(wait)
+    return problems
+
+
+async def _run_async(questions, states, max_inflight, sql_threads, progress):
+    async def run(q, inflight):
+        state = states[str(q.get("question_id"))]
+        while True:
+            async with inflight:
+                failure = await _aprocess_question(q, state)
+            progress.update(1)
+            if failure is None:
+                state.release()
+                return None
+            delay = state.next_retry_delay()
+            if delay is None:
+                state.release()
+                return q
+            # Requeue in-run: the question releases its slot and waits out its retry delay.
+            progress.total += 1
+            progress.refresh()
+            await asyncio.sleep(delay)
+
+    return [q for q in await run_bounded(questions, run, max_inflight, sql_threads) if q is not None]
+
+
+class BatchItem:
+    """A question waiting on batch responses: its next request and what earlier waves produced"""
+
+    def __init__(self, question, pred_res, gold_res):
+        self.question = question
+        # Prompts only ever show the first 20 rows, so that is all the state file keeps.
+        self.pred_res = pred_res.head(20)
+        self.gold_res = gold_res.head(20)
+        self.stage = None
+        self.model = None
+        self.messages = None
+        self.params = {}
+        self.attempts = 0
+        self.prover = None
+        self.refuter = None
+        self.score = 0.0
+        self.question_obj = None
+        self.constraints = None
+        self.rubric = None
+
+    @property
+    def custom_id(self):
+        return f"{self.question.get('question_id')}:{self.stage}"
+
+    def request(self, stage, model, messages, params=None):
+        self.stage, self.model, self.messages, self.params, self.attempts = stage, model, messages, params or {}, 0
+        return False
+
+
+def _batch_start(item, compare_equal):
+    """Queue the first request of a question whose SQL results are known"""
+    question, pred_sql = item.question, item.question["predicted_sql"]
+    if compare_equal:
+        return item.request("refuter", Refuter.model, Refuter._messages(question, pred_sql))
+    return item.request("prover", Prover.model, Prover._messages(question, pred_sql, item.pred_res))
+
+
+def _batch_finish(item):
+    write_result_to_file(item.question, item.question["predicted_sql"], item.score,
+                         item.prover[0] if item.prover else None, item.refuter, output_dir)
+    return True
+
+
+def _batch_partial(item):
+    if item.score == 1.0 or not partial:
+        return _batch_finish(item)
+    item.question_obj = PartialEval._question_obj(item.question)
+    return item.request("decomposer", PartialEval.model, Decomposer(item.question_obj, model=PartialEval.model)._messages(), {"temperature": 0})
 
-    write_result_to_file(question, pred_sql, score, prover_verdict, refuter_verdict, output_dir)
+
+def _batch_advance(item, content):
+    """Apply a response to item and queue its next request; True once the question is scored"""
+    question, pred_sql = item.question, item.question["predicted_sql"]
+    if item.stage == "prover":
+        verdict, reason = Prover._finish(question, content)
+        if verdict is None:
+            raise ValueError("response has no verdict")
+        item.prover = (verdict, reason)
+        if verdict:
+            return item.request("refuter", Refuter.model, Refuter._messages(question, pred_sql, item.pred_res, item.gold_res, reason))
+        return _batch_partial(item)
+    if item.stage == "refuter":
+        verdict = Refuter._finish(question, content)
+        if verdict is None:
+            raise ValueError("response has no verdict")
+        item.refuter = verdict
+        item.score = 1.0 if not verdict else 0.0
+        return _batch_finish(item) if item.prover is None else _batch_partial(item)
+    if item.stage == "decomposer":
+        item.constraints = Decomposer(item.question_obj, model=PartialEval.model)._parse(content)
+        translator = Translator(item.question_obj, item.constraints, model=PartialEval.model)
+        return item.request("translator", PartialEval.model, translator._messages(), {"temperature": 0})
+    if item.stage == "translator":
+        item.rubric = Translator(item.question_obj, item.constraints, model=PartialEval.model)._parse(content)
+        grader = Grader(item.question_obj, item.rubric, model=PartialEval.model)
+        return item.request("grader", PartialEval.model, grader._messages(pred_sql), {"temperature": 0})
+    grading = Grader(item.question_obj, item.rubric, model=PartialEval.model)._parse(content)
+    item.score = PartialEval._calculate_usefulness_score(grading, item.rubric)
+    return _batch_finish(item)
+
+
+def _batch_prepare(questions, num_threads, progress):
+    """Phase one: execute every question's SQL and queue its first LLM request"""
+    def prepare(q):
+        state = QuestionState()
+        state.pred_res, state.gold_res = _execute_pair(q["db_id"], q["predicted_sql"], q["gold_sql"])
+        if state.pred_res is False:
+            write_result_to_file(q, q["predicted_sql"], 0.0, None, None, output_dir)
+            return None
+        if _sql_failure(state):
+            return str(q.get("question_id"))
+        item = BatchItem(q, state.pred_res, state.gold_res)
+        _batch_start(item, compare_result(state.pred_res, state.gold_res))
+        return item
+
+    def prepare_one(q):
+        res = prepare(q)
+        progress.update(1)
+        return res
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        prepared = list(executor.map(prepare_one, questions))
+    return [x for x in prepared if isinstance(x, BatchItem)], [x for x in prepared if isinstance(x, str)]
+
+
+def _run_batch(questions, batch_dir, num_threads, progress, responses_path=None, max_attempts=3):
+    """Advance the offline batch pipeline by one wave; returns problem ids once every question is settled.
+
+    A finished run leaves its state file marked complete (items None), so running again reports it instead of waiting.
+    """
+    os.makedirs(batch_dir, exist_ok=True)
+    state_path = os.path.join(batch_dir, "batch_state.pkl")
+    if not os.path.exists(state_path):
+        items, problems = _batch_prepare(questions, num_threads, progress)
+        wave = 1
+    else:
+        with open(state_path, "rb") as f:
+            wave, items, problems = pickle.load(f)
+        if not items:
+            print(f"Batch run in {batch_dir} already complete after {wave - 1} waves ({len(problems)} unresolved questions); "
+                  f"remove {state_path} to start a new one")
+            return None
+        responses_path = responses_path or os.path.join(batch_dir, f"wave_{wave}_responses.jsonl")
+        if not os.path.exists(responses_path):
+            print(f"Waiting for responses to {os.path.join(batch_dir, f'wave_{wave}_requests.jsonl')} at {responses_path}")
+            return None
+        contents = read_batch_responses(responses_path)
+        pending = []
+        for item in items:
+            try:
+                content = contents.get(item.custom_id)
+                if content is None:
+                    raise ValueError("no successful response in the batch output")
+                done = _batch_advance(item, content)
+            except Exception as e:
+                print(f"Batch {item.custom_id} failed: {e}")
+                item.attempts += 1
+                done = False
+                if item.attempts >= max_attempts:
+                    problems.append(str(item.question.get("question_id")))
+                    continue
+            if not done:
+                pending.append(item)
+        items = pending
+        wave += 1
+    if items:
+        requests_path = os.path.join(batch_dir, f"wave_{wave}_requests.jsonl")
+        write_batch_requests(requests_path, [(item.custom_id, item.model, item.messages, item.params) for item in items])
+        print(f"Wave {wave}: {len(items)} requests ({dict(Counter(item.stage for item in items))}) written to {requests_path}")
+    with open(state_path, "wb") as f:
+        pickle.dump((wave, items or None, problems), f, protocol=pickle.HIGHEST_PROTOCOL)
+    if not items:
+        print(f"Batch run complete after {wave - 1} waves: {len(problems)} unresolved questions")
+        return problems
     return None
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--threads", type=int, default=1)
-    parser.add_argument("--input", type=str, default="sample.json")
+    add_run_arguments(parser)
+    parser.add_argument("--no-gold-cache", action="store_true", help="Always re-execute gold SQL")
+    parser.add_argument("--stream-results", action="store_true", help="Fingerprint results while streaming rows instead of loading whole DataFrames")
+    parser.add_argument("--probe", action="store_true", help="COUNT(*) both queries first and skip full execution when their shapes differ")
+    parser.add_argument("--probe-timeout", type=float, default=5.0, help="Timeout in seconds for each --probe query")
+    parser.add_argument("--replica-budget-mb", type=int, default=0, help="Per-worker memory budget for in-memory copies of the most-asked databases (pool/inprocess)")
+    parser.add_argument("--batch-dir", type=str, default=None, help="Offline batch mode: each invocation advances one wave of LLM requests kept in this directory")
+    parser.add_argument("--batch-responses", type=str, default=None, help="Batch output JSONL for the current wave (default <batch-dir>/wave_<n>_responses.jsonl)")
     args = parser.parse_args()
     reasoning_model = "o3"
     instruct_model = "deepseek-chat"
     partial = False
+    stream_results = args.stream_results
+    probe_timeout = args.probe_timeout if args.probe else 0
 
     input_stem = re.sub(r"(-result)$", "", os.path.splitext(os.path.basename(args.input))[0])
     output_dir = f"output/{input_stem}/{reasoning_model}-{input_stem}-eval"
     os.makedirs(output_dir, exist_ok=True)
 
-    Prover = Prover(model=reasoning_model, output_dir=output_dir)
-    Refuter = Refuter(model=reasoning_model, output_dir=output_dir)
+    run_setup = RunSetup(args, output_dir)
+    Prover = Prover(model=reasoning_model, output_dir=output_dir, **run_setup.verifier_options)
+    Refuter = Refuter(model=reasoning_model, output_dir=output_dir, **run_setup.verifier_options)
     PartialEval = PartialScoringPipeline(model=instruct_model)
+    gold_cache = None if args.no_gold_cache else GoldResultCache(os.path.join(args.cache_dir, "gold"))
 
     problem_ids: List[str] = []
     num_threads = max(1, int(args.threads))
@@ -97,25 +452,42 @@ if __name__ == "__main__":
     to_process = len(questions)
     print(f"Input total: {total_input}, To process: {to_process}")
 
-    progress = tqdm(total=to_process, dynamic_ncols=True, mininterval=0.5)
+    replicas = []
+    if args.replica_budget_mb > 0:
+        question_counts = Counter(str(_get_db_path(q["db_id"])) for q in questions)
+        replicas = select_replicas(question_counts, args.replica_budget_mb << 20)
+        print(f"In-memory replicas: {len(replicas)} databases covering {sum(question_counts[p] for p in replicas)}/{to_process} questions")
+        if args.sql_backend == "spawn":
+            print("Warning: --replica-budget-mb has no effect with --sql-backend spawn")
+    configure_sql_backend(args.sql_backend, workers=args.sql_workers or 2 * max(1, args.threads), max_ops=args.sql_max_ops,
+                          initializer=load_replicas if replicas else None, initargs=(replicas, args.replica_budget_mb << 20))
+    # Every question thread runs pred and gold together, so gold jobs never queue behind other questions.
+    configure_concurrency(num_threads)
 
-    def worker(idx):
-        local_problems = []
-        slice_questions = questions[idx::num_threads]
-        for q in slice_questions:
-            pid = _process_question(q)
-            if pid:
-                local_problems.append(pid)
-            progress.update(1)
-        return local_problems
+    progress = tqdm(total=to_process, dynamic_ncols=True, mininterval=0.5)
 
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        futures = [executor.submit(worker, i) for i in range(num_threads)]
-        for f in futures:
-            problem_ids.extend(f.result())
+    states = {str(q.get("question_id")): QuestionState() for q in questions}
+    if args.batch_dir:
+        # Phase one runs on the first invocation; later ones ingest a wave of responses each.
+        failed = []
+        problem_ids.extend(_run_batch(questions, args.batch_dir, num_threads, progress, args.batch_responses) or [])
+    elif args.async_mode:
+        # --threads sizes the executor that runs SQL; LLM concurrency comes from --max-inflight/--model-concurrency.
+        failed = asyncio.run(_run_async(questions, states, max(1, args.max_inflight), num_threads, progress))
+    else:
+        failed = _run_threads(questions, states, num_threads, progress)
+    problem_ids.extend(str(q.get("question_id")) for q in failed)
 
     progress.close()
+    run_setup.report()
+    if replicas:
+        stats = [s for s in run_everywhere(replica_stats) if s]
+        hits, misses = sum(s["hits"] for s in stats), sum(s["misses"] for s in stats)
+        print(f"In-memory replicas: {hits} hits, {misses} misses (hit ratio {hits / max(1, hits + misses):.1%}), "
+              f"{sum(s['replica_bytes'] for s in stats) / (1 << 20):.1f} MiB across {len(stats)} workers")
 
+    if failed:
+        print(f"Unresolved after retries: {dict(Counter(states[pid].failure.kind for pid in problem_ids))}")
     if len(problem_ids) > 0:
         os.makedirs(method_root_dir, exist_ok=True)
         with open(problems_file_path, "w", encoding="utf-8") as f:
@@ -0,0 +1,367 @@
+import json
+import time
+import sqlite3
+import threading
+from types import SimpleNamespace
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pandas as pd
+import pytest
+import main
+from evaluators import results, llm, executor, utils
+from evaluators.results import ResultSummary, hash_dataframe, hash_values
+from evaluators.utils import JSONObjectScanner, compare_result, sql_identifiers
+from evaluators.lexer import tokenize
+from evaluators.cache import GoldResultCache, SQLResultCache, LLMResponseCache, normalize_sql
+from evaluators.executor import SQLWorkerPool, _pack_result, _unpack_result
+from evaluators.schema import SchemaCatalog
+from evaluators.batch import run_canned_batch
+from evaluators.partial_scoring import Grader
+
+
+def _df(rows, columns=("a", "b")):
+    return pd.DataFrame.from_records(rows, columns=list(columns), coerce_float=True)
+
+
+def test_bag_counts_duplicate_rows():
+    # XOR-reducing row hashes made [a, a, b] equal to [b].
+    assert hash_dataframe(_df([(1, "x"), (1, "x"), (2, "y")])) != hash_dataframe(_df([(2, "y")]))
+    assert not compare_result(_df([(1, "x"), (1, "x"), (2, "y")]), _df([(1, "x"), (2, "y"), (2, "y")]))
+    assert compare_result(_df([(1, "x"), (2, "y"), (1, "x")]), _df([(2, "y"), (1, "x"), (1, "x")]))
+
+
+def test_set_ignores_duplicates_but_not_missing_rows():
+    assert compare_result(_df([(1, "x"), (1, "x"), (2, "y")]), _df([(2, "y"), (1, "x")]), semantics="set")
+    assert not compare_result(_df([(1, "x"), (1, "x"), (2, "y")]), _df([(2, "y")]), semantics="set")
+
+
+def test_list_requires_row_order():
+    assert compare_result(_df([(1, "x"), (2, "y")]), _df([(1, "x"), (2, "y")]), semantics="list")
+    assert not compare_result(_df([(1, "x"), (2, "y")]), _df([(2, "y"), (1, "x")]), semantics="list")
+
+
+def test_column_order_only_matters_for_set_and_list():
+    df, swapped = _df([(1, "x"), (2, "y")]), _df([("x", 1), ("y", 2)], ("b", "a"))
+    assert compare_result(df, swapped)
+    assert not compare_result(df, swapped, semantics="set")
+
+
+def test_numbers_compare_by_value_and_text_by_the_number_it_spells():
+    one = hash_values(np.array([1]))[0]
+    assert hash_values(np.array([1.0]))[0] == one
+    assert hash_values(np.array([1, "x"], dtype=object))[0] == one
+    assert hash_values(np.array([1.0, "x"], dtype=object))[0] == one
+    assert hash_values(np.array([2 ** 53 + 1, "x"], dtype=object))[0] != hash_values(np.array([2 ** 53, "x"], dtype=object))[0]
+    # Like the str() hashing it replaced, text equals the number it spells.
+    assert hash_values(np.array(["1"], dtype=object))[0] == one
+    assert hash_values(np.array(["1", str(10 ** 30)], dtype=object))[0] == one
+    assert hash_values(np.array(["1.5"], dtype=object))[0] == hash_values(np.array([1.5]))[0]
+    assert hash_values(np.array([str(2 ** 53 + 1)], dtype=object))[0] == hash_values(np.array([2 ** 53 + 1]))[0]
+    for other in ("01", "1.50", "-0", " 1", "1x"):
+        assert hash_values(np.array([other], dtype=object))[0] != one
+        assert hash_values(np.array([other], dtype=object))[0] != hash_values(np.array([1.5]))[0]
+    assert compare_result(_df([("1", "x"), ("2.5", "y")]), _df([(1, "x"), (2.5, "y")]))
+
+
+
+@pytest.mark.parametrize("semantics", ["bag", "set", "list"])
+def test_empty_results_equal_each_other_only(semantics):
+    assert compare_result(_df([]), _df([]), semantics=semantics)
+    assert not compare_result(_df([]), _df([(1, "x")]), semantics=semantics)
+    assert not compare_result(_df([(1, "x")]), _df([]), semantics=semantics)
+
+
+def test_null_differs_from_the_text_it_prints_as():
+    assert compare_result(_df([(None, "x")]), _df([(np.nan, "x")]))
+    for text in ("None", "nan", ""):
+        assert not compare_result(_df([(None, "x")]), _df([(text, "x")]))
+
+
+def test_summary_round_trips_through_its_dict():
+    summary = ResultSummary.from_rows([(1, "x"), (1, "x"), (None, "y")], ["a", "b"], semantics="set")
+    restored = ResultSummary.from_dict(json.loads(json.dumps(summary.to_dict())))
+    assert restored.fingerprints == summary.fingerprints and restored.shape == (3, 2)
+    assert compare_result(restored, _df([(None, "y"), (1, "x")]), semantics="set")
+
+@pytest.mark.parametrize("semantics", ["bag", "set", "list"])
+def test_chunked_summary_matches_whole_frame(monkeypatch, semantics):
+    rows = [(2 ** 53 + 1, "a"), ("x", None), (3, 1.5)] + [(i, str(i)) for i in range(10)] + [(1.0, "a"), (1, "a")]
+    monkeypatch.setattr(results, "FETCH_SIZE", 4)
+    summary = ResultSummary.from_rows(rows, ["a", "b"], semantics=semantics)
+    assert summary.fingerprints[semantics] == hash_dataframe(_df(rows), semantics)
+    assert compare_result(summary, _df(rows), semantics=semantics)
+
+
+def test_normalize_sql_keeps_whitespace_inside_literals():
+    assert normalize_sql("  SELECT 1;  \n") == "SELECT 1"
+    assert normalize_sql("SELECT 'a\nb'") != normalize_sql("SELECT 'a b'")
+    assert normalize_sql('SELECT "a  b" FROM t') != normalize_sql('SELECT "a b" FROM t')
+
+
+def test_normalize_sql_collapses_whitespace_outside_literals_and_comments():
+    assert normalize_sql("SELECT a,\n\t b  FROM t ;") == normalize_sql("SELECT a, b FROM t")
+    assert normalize_sql("SELECT a -- note\n  FROM t") == "SELECT a -- note\nFROM t"
+    assert normalize_sql("SELECT a /* x  y */ FROM t") != normalize_sql("SELECT a /* x y */ FROM t")
+
+
+def test_caches_do_not_store_execution_errors(tmp_path):
+    db = tmp_path / "db.sqlite"
+    db.write_bytes(b"db")
+    summary = ResultSummary.from_rows([(1,)], ["a"])
+    gold = GoldResultCache(tmp_path / "gold")
+    gold.put(db, "SELECT 1", False)
+    assert gold.get(db, "SELECT 1") is None
+    gold.put(db, "SELECT 1", summary)
+    assert gold.get(db, "SELECT 1").fingerprints == summary.fingerprints
+    sql = SQLResultCache(tmp_path / "sql")
+    sql.put(db, "SELECT 1", False, 1.0)
+    assert sql.get(db, "SELECT 1") is None and sql.saved_seconds == 0
+
+
+def test_sql_cache_memory_tier_stays_within_its_byte_budget(tmp_path):
+    db = tmp_path / "db.sqlite"
+    db.write_bytes(b"db")
+    cache = SQLResultCache(tmp_path / "sql", max_bytes=1 << 20)
+    for i in range(10):
+        cache.put(db, f"SELECT {i}", pd.DataFrame({"a": range(50_000)}))
+    assert 0 < cache.memory_bytes <= 1 << 20
+    assert len(cache.memory) < 10
+
+
+def test_sql_cache_disk_tier_evicts_least_recently_used_files(tmp_path):
+    db = tmp_path / "db.sqlite"
+    db.write_bytes(b"db")
+    cache = SQLResultCache(tmp_path / "sql", max_disk_bytes=1 << 20)
+    for i in range(10):
+        cache.put(db, f"SELECT {i}", pd.DataFrame({"a": range(20_000)}))
+    assert 0 < cache.disk_bytes <= 1 << 20 and cache.evicted > 0
+    assert sum(f.stat().st_size for f in (tmp_path / "sql").glob("*/*.pkl")) == cache.disk_bytes
+    assert SQLResultCache(tmp_path / "sql", max_bytes=0).get(db, "SELECT 9") is not None
+
+
+
+def test_llm_cache_keeps_a_running_byte_total(tmp_path):
+    cache = LLMResponseCache(tmp_path / "llm.sqlite", max_bytes=10_000)
+    statements = []
+    cache.conn.set_trace_callback(statements.append)
+    cache.put("m", [{"role": "user", "content": "q"}], {}, "a" * 1000)
+    cache.put("m", [{"role": "user", "content": "q"}], {}, "b" * 500)  # replaces the first answer
+    assert cache.total_bytes == 500
+    assert not any("SUM(" in s for s in statements)
+    for i in range(30):
+        cache.put("m", [{"role": "user", "content": str(i)}], {}, "c" * 1000)
+    assert cache.evicted > 0 and cache.total_bytes <= 10_000
+    assert LLMResponseCache(tmp_path / "llm.sqlite").total_bytes == cache.total_bytes
+
+
+def test_atomic_write_leaves_the_old_file_on_failure_or_oversize(tmp_path):
+    path = tmp_path / "entry.json"
+    assert utils.atomic_write(path, lambda f: f.write("old")) == 3
+
+    def fail(f):
+        f.write("partial")
+        raise ValueError
+    with pytest.raises(ValueError):
+        utils.atomic_write(path, fail)
+    assert utils.atomic_write(path, lambda f: f.write(b"x" * 10), binary=True, max_bytes=5) is None
+    assert path.read_text() == "old" and list(tmp_path.iterdir()) == [path]
+
+def test_scanner_skips_objects_without_the_required_key():
+    scanner = JSONObjectScanner("verdict")
+    text = 'Example: {"reason": "..."} then {"a": {"verdict": 1}} and ```json\n{"reason": "a } b", "verdict": true}\n``` trailing'
+    found = [obj for obj in (scanner.feed(text[i:i + 5]) for i in range(0, len(text), 5)) if obj is not None]
+    assert found == ['{"reason": "a } b", "verdict": true}']
+
+
+def _catalog(*tables):
+    return SchemaCatalog("db", {"tables": list(tables), "columns": {}, "foreign_keys": {}, "unique": {}, "ddl": [], "descriptions": None})
+
+
+def test_referenced_tables_only_counts_table_positions():
+    catalog = _catalog("account", "loan", "order", "posts", "tags")
+    assert catalog.referenced_tables("SELECT a FROM loan ORDER BY amount") == ["loan"]
+    assert catalog.referenced_tables("SELECT Tags FROM posts WHERE Id = 1") == ["posts"]
+    assert catalog.referenced_tables("SELECT T1.a FROM loan AS T1 JOIN account AS T2 ON T1.id = T2.id") == ["account", "loan"]
+    assert catalog.referenced_tables("SELECT loan.a FROM loan, main.account WHERE x IN (SELECT y FROM tags)") == ["account", "loan", "tags"]
+    assert catalog.referenced_tables("SELECT a FROM (SELECT posts FROM account) AS t, loan") == ["account", "loan"]
+    assert catalog.referenced_tables("SELECT COUNT(*) FROM `order` GROUP BY tags.x -- FROM posts") == ["order", "tags"]
+
+
+def test_referenced_tables_matches_quoted_names_with_spaces():
+    catalog = _catalog("Credit Card", "Order Details", "Sales")
+    sql = 'SELECT "Credit Card".id FROM [Order Details] JOIN "credit card" ON 1 WHERE Sales = \'FROM Sales\''
+    assert catalog.referenced_tables(sql) == ["Credit Card", "Order Details"]
+
+
+def test_table_detection_pruning_and_cache_keys_share_one_tokenizer():
+    sql = "SELECT `Order Details`.qty * 2, COUNT(*) FROM [Order Details] -- FROM posts\nWHERE note = 'FROM posts'"
+    assert "".join(t.text for t in tokenize(sql)) == sql
+    assert _catalog("Order Details", "posts").referenced_tables(sql) == ["Order Details"]
+    names, star = sql_identifiers(sql)
+    assert {"order details", "qty", "note"} <= names and "posts" not in names and not star
+    assert sql_identifiers("SELECT t.* FROM t")[1] and sql_identifiers("SELECT DISTINCT * FROM t")[1]
+    assert normalize_sql(sql) == normalize_sql(sql.replace("FROM [", "FROM \t ["))
+    assert normalize_sql(sql) != normalize_sql(sql.replace("\nWHERE", " WHERE"))
+
+
+def test_pool_wait_for_a_worker_counts_against_the_deadline():
+    pool = SQLWorkerPool(1)
+    try:
+        busy = threading.Thread(target=pool.run, args=(time.sleep, 3), kwargs={"timeout": 5})
+        busy.start()
+        time.sleep(0.2)
+        started = time.monotonic()
+        assert pool.run(abs, -1, timeout=0.5) is None
+        assert time.monotonic() - started < 1.0
+        cancel = threading.Event()
+        threading.Timer(0.2, cancel.set).start()
+        started = time.monotonic()
+        assert pool.run(abs, -1, timeout=5, cancel=cancel) is None
+        assert time.monotonic() - started < 1.0
+        busy.join()
+        assert pool.run(abs, -1, timeout=5) == 1
+    finally:
+        pool.close()
+
+
+def test_batch_run_advances_waves_from_canned_responses(tmp_path, monkeypatch):
+    written = {}
+    messages = lambda *args: [{"role": "user", "content": "..."}]
+    verdict = lambda content: json.loads(content)["verdict"]
+    monkeypatch.setattr(main, "Prover", SimpleNamespace(model="m", _messages=messages, _finish=lambda q, c: (verdict(c), "reason")))
+    monkeypatch.setattr(main, "Refuter", SimpleNamespace(model="m", _messages=messages, _finish=lambda q, c: verdict(c)))
+    monkeypatch.setattr(main, "_execute_pair", lambda *args: (_df([(1, "x")]), _df([(2, "y")])))
+    monkeypatch.setattr(main, "write_result_to_file", lambda q, sql, score, *rest: written.__setitem__(q["question_id"], score))
+    monkeypatch.setattr(main, "partial", False, raising=False)
+    monkeypatch.setattr(main, "output_dir", str(tmp_path), raising=False)
+    questions = [{"question_id": i, "db_id": "db", "predicted_sql": "p", "gold_sql": "g"} for i in (1, 2, 3)]
+    progress = SimpleNamespace(update=lambda n: None)
+    run = lambda: main._run_batch(questions, str(tmp_path), 2, progress, max_attempts=2)
+
+    def answer(wave, canned):
+        with open(tmp_path / "canned.jsonl", "w", encoding="utf-8") as f:
+            f.writelines(json.dumps({"custom_id": k, "content": json.dumps({"verdict": v})}) + "\n" for k, v in canned.items())
+        return run_canned_batch(tmp_path / f"wave_{wave}_requests.jsonl", tmp_path / f"wave_{wave}_responses.jsonl", tmp_path / "canned.jsonl")
+
+    assert run() is None
+    assert run() is None  # wave 1 has no responses yet
+    # Partial wave: question 2 gets no answer and question 3 an answer without a verdict, so both are retried.
+    assert answer(1, {"1:prover": True, "3:prover": None}) == 2
+    assert run() is None and written == {}
+    assert answer(2, {"1:refuter": False, "2:prover": False}) == 2
+    assert run() == ["3"]
+    assert written == {1: 1.0, 2: 0.0}
+    assert run() is None  # the finished run is reported, not restarted
+
+
+def test_partial_scoring_answers_are_cached_only_as_arrays(tmp_path, monkeypatch):
+    cache = LLMResponseCache(tmp_path / "llm.sqlite")
+    monkeypatch.setattr(llm, "_response_cache", cache)
+    answers = iter(['{"id": "1", "answer": "yes"}', '```json\n[{"id": "1", "answer": "yes"}]\n```'])
+    reply = lambda content: SimpleNamespace(usage=None, choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=lambda **kw: reply(next(answers)))))
+    question = {"schema": "", "question_id": 1, "question": "q", "evidence": ""}
+    grader = Grader(question, [], output_dir=str(tmp_path), model="m", client=client)
+    with pytest.raises(ValueError):
+        grader.call("SELECT 1")
+    assert cache.writes == 0
+    assert grader.call("SELECT 1") == [{"id": "1", "answer": "yes"}]
+    assert cache.writes == 1 and grader.call("SELECT 1") == [{"id": "1", "answer": "yes"}] and cache.hits == 1
+    cache.close()
+
+
+@pytest.mark.parametrize("rows", [3, 50_000])
+def test_packed_results_round_trip_inline_and_through_shared_memory(rows):
+    df = pd.DataFrame({"n": np.arange(rows), "f": np.arange(rows) / 2, "s": [str(i) for i in range(rows)]})
+    packed = _pack_result(df)
+    assert (packed[1] is None) == (rows == 3)
+    pd.testing.assert_frame_equal(_unpack_result(packed), df)
+    assert _unpack_result(_pack_result(False)) is False
+
+
+def test_execute_pair_summarizes_both_sides_when_gold_is_cached(tmp_path, monkeypatch):
+    db = tmp_path / "db.sqlite"
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE t (a INTEGER)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(2 ** 53 + 1,), (2 ** 53 + 3,), (None,)])
+    monkeypatch.setattr(executor, "_backend", "inprocess")
+    # The first chunk has no NULL and stays int64; a whole-result DataFrame turns the column into float64.
+    monkeypatch.setattr(utils, "FETCH_SIZE", 2)
+    monkeypatch.setattr(main, "gold_cache", GoldResultCache(tmp_path / "gold"), raising=False)
+    monkeypatch.setattr(main, "stream_results", False, raising=False)
+    monkeypatch.setattr(main, "probe_timeout", 0, raising=False)
+    sql = "SELECT a FROM t"
+    for _ in range(2):  # gold executed, then served from the gold cache
+        pred, gold = main._execute_pair(db, sql, sql)
+        assert isinstance(pred, ResultSummary) and isinstance(gold, ResultSummary)
+        assert compare_result(pred, gold)
+
+
+
+def test_gold_results_are_stored_only_in_the_gold_cache(tmp_path, monkeypatch):
+    db = tmp_path / "db.sqlite"
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE t (a INTEGER)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(1,), (2,)])
+    monkeypatch.setattr(executor, "_backend", "inprocess")
+    sql_cache = SQLResultCache(tmp_path / "sql")
+    monkeypatch.setattr(utils, "_result_cache", sql_cache)
+    monkeypatch.setattr(main, "gold_cache", GoldResultCache(tmp_path / "gold"), raising=False)
+    monkeypatch.setattr(main, "stream_results", False, raising=False)
+    monkeypatch.setattr(main, "probe_timeout", 0, raising=False)
+    gold_sql = "SELECT a FROM t ORDER BY a"
+    main._execute_pair(db, "SELECT a FROM t", gold_sql)
+    assert main.gold_cache.get(db, gold_sql) is not None
+    assert sql_cache.get(db, gold_sql, "summarize_sql") is None
+    assert sql_cache.get(db, "SELECT a FROM t", "summarize_sql") is not None
+
+def _probe_db(tmp_path, monkeypatch):
+    db = tmp_path / "db.sqlite"
+    with sqlite3.connect(db) as conn:
+        conn.execute("CREATE TABLE t (a INTEGER, b TEXT)")
+        conn.executemany("INSERT INTO t VALUES (?, ?)", [(i, str(i)) for i in range(30)])
+    monkeypatch.setattr(executor, "_backend", "inprocess")
+    monkeypatch.setattr(main, "gold_cache", None, raising=False)
+    monkeypatch.setattr(main, "stream_results", False, raising=False)
+    monkeypatch.setattr(main, "probe_timeout", 5.0, raising=False)
+    return db
+
+
+def test_probe_ignores_trailing_semicolons_and_comments(tmp_path, monkeypatch):
+    db = _probe_db(tmp_path, monkeypatch)
+    for sql in ("SELECT a FROM t; -- note", "SELECT a FROM t -- note", "SELECT a FROM t ;\n/* done */ ;  "):
+        assert utils.probe_sql(db, sql) == (30, 1)
+    # Shapes differ, so only the previews are fetched.
+    pred, gold = main._execute_pair(db, "SELECT a FROM t WHERE a < 5; -- five", "SELECT a, b FROM t;")
+    assert isinstance(pred, ResultSummary) and pred.shape == (5, 1) and gold.shape == (30, 2)
+
+
+def test_failed_probe_falls_back_to_full_execution(tmp_path, monkeypatch):
+    db = _probe_db(tmp_path, monkeypatch)
+    # PRAGMA cannot be wrapped in a subquery, so its probe fails and both sides run in full.
+    assert utils.probe_sql(db, "PRAGMA table_info(t)") is False
+    pred, gold = main._execute_pair(db, "PRAGMA table_info(t)", "SELECT a FROM t")
+    assert isinstance(pred, pd.DataFrame) and len(pred) == 2 and len(gold) == 30
+
+
+def _create_result_block_and_hang(path):
+    # Runs in a worker: the result block exists, but the worker is killed before sending it.
+    shm = SharedMemory(create=True, size=1 << 16, name=executor._result_shm_name)
+    shm.close()
+    with open(path, "w") as f:
+        f.write(shm.name)
+    time.sleep(60)
+
+
+def test_killed_workers_leave_no_shared_memory_behind(tmp_path, monkeypatch):
+    monkeypatch.setattr(executor, "_KILL_GRACE", 0.2)
+    pool = SQLWorkerPool(1)
+    try:
+        for i, run in enumerate((executor.run_in_subprocess, pool.run)):
+            path = tmp_path / f"shm{i}"
+            assert run(_create_result_block_and_hang, str(path), timeout=3) is None
+            with pytest.raises(FileNotFoundError):
+                SharedMemory(name=path.read_text())
+        assert pool.recycled == 1
+    finally:
+        pool.close()